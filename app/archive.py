@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import zlib
+
+from sqlalchemy import insert, delete, text
+from sqlalchemy.future import select
+
+from models import Game, Move, GameArchive
+from game_logic import pack_desk, load_desk
+from metrics import ERRORS
+
+#Сжатый журнал ходов архивной игры: по 2 байта на ход (клетка col * 10 + row; результат | 4, если стрелял второй игрок)
+def pack_moves(moves, player2_id: int):
+    data = bytearray()
+    for move in moves:
+        data.append(move.col * 10 + move.row)
+        data.append(move.result | (4 if move.player_id == player2_id else 0))
+    return zlib.compress(bytes(data))
+
+#Ходы архивной игры в том же виде, что и строки moves
+def unpack_moves(data, player1_id: int, player2_id: int):
+    data = zlib.decompress(data)
+    return [
+        {
+            "seq": i // 2 + 1,
+            "player": player2_id if data[i + 1] & 4 else player1_id,
+            "col": data[i] // 10,
+            "row": data[i] % 10,
+            "result": data[i + 1] & 3
+        }
+        for i in range(0, len(data), 2)
+    ]
+
+#Перенос закончившихся игр из games в games_archive. Живая таблица games содержит только активные и недавние игры.
+#Игры переносятся пачками в одной транзакции: строки архива, удаление ходов и игр.
+#Несколько воркеров разбирают разные пачки (FOR UPDATE SKIP LOCKED в Postgres)
+class GameArchiver:
+    def __init__(self, session_factory, retention_days: float, interval: float = 600, batch: int = 500):
+        self.session_factory = session_factory
+        self.retention = datetime.timedelta(days=retention_days)
+        self.interval = interval
+        self.batch = batch
+
+    #Секции архива (Postgres) по месяцам окончания игр
+    async def ensure_partitions(self, db, dates):
+        if db.bind.dialect.name != "postgresql":
+            return
+        for month in sorted({(date.year, date.month) for date in dates}):
+            start = datetime.date(month[0], month[1], 1)
+            end = datetime.date(month[0] + month[1] // 12, month[1] % 12 + 1, 1)
+            await db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS games_archive_{start:%Y_%m} PARTITION OF games_archive "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            ))
+
+    #Одна пачка. Возвращает количество перенесенных игр
+    async def archive_batch(self, now=None):
+        cutoff = (now or datetime.datetime.utcnow()) - self.retention
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(Game.id, Game.date_created, Game.date_ended, Game.player1_id, Game.player2_id, Game.winner_id,
+                       Game.initial_desk_data, Game.initial_desk)
+                .where(Game.date_ended.isnot(None), Game.date_ended < cutoff)
+                .order_by(Game.date_ended)
+                .limit(self.batch)
+                .with_for_update(skip_locked=True)
+            )
+            games = result.all()
+            if not games:
+                return 0
+            ids = [game.id for game in games]
+
+            result = await db.execute(select(Move).where(Move.game_id.in_(ids)).order_by(Move.game_id, Move.seq))
+            moves = {}
+            for move in result.scalars().all():
+                moves.setdefault(move.game_id, []).append(move)
+
+            rows = []
+            for game in games:
+                game_moves = moves.get(game.id, [])
+                initial_desk = load_desk(game.initial_desk_data, game.initial_desk)
+                rows.append({
+                    "id": game.id,
+                    "date_ended": game.date_ended,
+                    "date_created": game.date_created,
+                    "player1_id": game.player1_id,
+                    "player2_id": game.player2_id,
+                    "winner_id": game.winner_id,
+                    "moves": len(game_moves),
+                    "initial_desk_data": pack_desk(initial_desk) if initial_desk is not None else None,
+                    "moves_data": pack_moves(game_moves, game.player2_id) if game_moves else None
+                })
+
+            await self.ensure_partitions(db, [game.date_ended for game in games])
+            await db.execute(insert(GameArchive).values(rows))
+            await db.execute(delete(Move).where(Move.game_id.in_(ids)))
+            await db.execute(delete(Game).where(Game.id.in_(ids)))
+            await db.commit()
+        return len(games)
+
+    #Фоновая задача: раз в интервал переносим пачки, пока они полные
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                while await self.archive_batch() == self.batch:
+                    await asyncio.sleep(0)
+            except Exception as e:
+                ERRORS.inc("archive")
+                print(f"Game archive error: {e}")
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.future import select
+
+from models import Player
+
+#Хеширование паролей: scrypt со случайной солью. Хеш хранится строкой "scrypt$n$r$p$соль$хеш"
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+#Хеширование выполняется в отдельных потоках, чтобы не останавливать цикл событий
+hash_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="password-hash")
+
+def hash_password(password: str) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+#Проверка пароля. Возвращает (пароль верный, хеш нужно пересчитать).
+#Старые хеши (sha256 без соли) принимаются и пересчитываются при входе
+def verify_password(password: str, stored: str):
+    if not stored.startswith("scrypt$"):
+        digest = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        ok = hmac.compare_digest(digest, stored)
+        return ok, ok
+    _, n, r, p, salt, expected = stored.split("$")
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    ok = hmac.compare_digest(digest.hex(), expected)
+    return ok, ok and (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(hash_executor, hash_password, password)
+
+async def verify_password_async(password: str, stored: str):
+    return await asyncio.get_running_loop().run_in_executor(hash_executor, verify_password, password, stored)
+
+#Токен сессии: "id_игрока.время_окончания.подпись", подпись - HMAC-SHA256 секретом сервера.
+#Проверяется без обращения к БД, поэтому подходит для всех воркеров с одним секретом
+def issue_token(player_id: int, secret: str, ttl: int) -> str:
+    payload = f"{player_id}.{int(time.time()) + ttl}"
+    signature = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}"
+
+#id игрока из токена или None, если токен неверный или истек
+def verify_token(token: str, secret: str):
+    try:
+        player_id, expires, signature = token.split(".")
+        payload = f"{player_id}.{expires}"
+        expected = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+        #Сравниваются байты: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(signature.encode(), expected.encode()) or int(expires) < time.time():
+            return None
+        return int(player_id)
+    except (AttributeError, ValueError):
+        return None
+
+#Кеш логинов игроков (id -> логин) с вытеснением давно не использованных (LRU) и временем жизни записи
+class LoginCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        #id игрока -> (логин, время окончания)
+        self.items: OrderedDict[int, tuple] = OrderedDict()
+
+    def get(self, player_id: int):
+        item = self.items.get(player_id)
+        if item is None:
+            return None
+        if item[1] < time.monotonic():
+            del self.items[player_id]
+            return None
+        self.items.move_to_end(player_id)
+        return item[0]
+
+    def put(self, player_id: int, login: str):
+        self.items[player_id] = (login, time.monotonic() + self.ttl)
+        self.items.move_to_end(player_id)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    #Логины игроков: из кеша, недостающие - одним запросом к БД
+    async def logins(self, session_factory, player_ids):
+        logins = {}
+        missing = []
+        for player_id in player_ids:
+            login = self.get(player_id)
+            if login is None:
+                missing.append(player_id)
+            else:
+                logins[player_id] = login
+        if missing:
+            async with session_factory() as db:
+                result = await db.execute(select(Player.id, Player.login).where(Player.id.in_(missing)))
+                for player_id, login in result.all():
+                    self.put(player_id, login)
+                    logins[player_id] = login
+        return logins
@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+#Шина событий между процессами (воркерами) сервера.
+#Событие - словарь, сериализуемый в JSON. handler - корутина, получающая события от всех воркеров
+
+#Один процесс: событий других воркеров нет, всё доставляется локально
+class LocalBackplane:
+    def __init__(self):
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def publish(self, event: dict):
+        return
+
+    async def stop(self):
+        self.handler = None
+
+#Несколько воркеров/подов с общей БД Postgres: события передаются через LISTEN/NOTIFY
+class PostgresBackplane:
+    def __init__(self, dsn: str, channel: str = "game_events"):
+        self.dsn = dsn
+        self.channel = channel
+        self.handler = None
+        self.listen_connection = None
+        self.publish_pool = None
+
+    async def start(self, handler):
+        import asyncpg
+
+        self.handler = handler
+        #Отдельное соединение для прослушивания канала и небольшой пул для публикации
+        self.listen_connection = await asyncpg.connect(self.dsn)
+        await self.listen_connection.add_listener(self.channel, self.on_notify)
+        self.publish_pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+
+    def on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        asyncio.get_running_loop().create_task(self.handler(event))
+
+    #Размер сообщения NOTIFY ограничен 8000 байт, через шину идут только небольшие игровые события
+    async def publish(self, event: dict):
+        async with self.publish_pool.acquire() as connection:
+            await connection.execute("SELECT pg_notify($1, $2)", self.channel, json.dumps(event))
+
+    async def stop(self):
+        if self.listen_connection is not None:
+            await self.listen_connection.remove_listener(self.channel, self.on_notify)
+            await self.listen_connection.close()
+            self.listen_connection = None
+        if self.publish_pool is not None:
+            await self.publish_pool.close()
+            self.publish_pool = None
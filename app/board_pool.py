@@ -0,0 +1,52 @@
+import asyncio
+from collections import deque
+
+from game_logic import get_desks
+from metrics import ERRORS
+
+#Пул заранее созданных пар досок. Создание игры забирает готовые доски,
+#фоновая задача дозаполняет пул в пуле потоков, не занимая цикл событий
+class BoardPool:
+    def __init__(self, size: int, strategy: str = "uniform", batch: int = 32):
+        self.size = size
+        self.strategy = strategy
+        self.batch = batch
+        self.boards = deque()
+        self.refill_needed = asyncio.Event()
+
+    #Пара досок для новой игры. Если пул пуст, доски создаются сразу
+    def take(self):
+        self.refill_needed.set()
+        if self.boards:
+            return self.boards.popleft()
+        return get_desks(self.strategy)
+
+    #Пары досок для пачки игр: сначала из пула, недостающие создаются в потоке, не блокируя цикл событий
+    async def take_many(self, count: int):
+        self.refill_needed.set()
+        desks = []
+        while self.boards and len(desks) < count:
+            desks.append(self.boards.popleft())
+        if len(desks) < count:
+            desks.extend(await asyncio.get_running_loop().run_in_executor(None, self.generate, count - len(desks)))
+        return desks
+
+    def generate(self, count: int):
+        return [get_desks(self.strategy) for _ in range(count)]
+
+    #Фоновая задача заполнения пула
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while len(self.boards) < self.size:
+                count = min(self.batch, self.size - len(self.boards))
+                try:
+                    desks = await loop.run_in_executor(None, self.generate, count)
+                except Exception as e:
+                    ERRORS.inc("board_pool")
+                    print(f"Board pool error: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                self.boards.extend(desks[:self.size - len(self.boards)])
+            self.refill_needed.clear()
+            await self.refill_needed.wait()
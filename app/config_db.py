@@ -1,5 +1,81 @@
+import os
+import secrets
+
 #DB_HOST = 'localhost'
 DB_HOST = 'host.docker.internal'
 DB_NAME = 'fast_api'
 DB_USER = 'admin'
-DB_PASSWORD = 'password'
\ No newline at end of file
+DB_PASSWORD = 'password'
+#Полный адрес БД для приложения (например, отдельная БД для нагрузочного теста). По умолчанию - Postgres из настроек выше
+DATABASE_URL = os.environ.get('DATABASE_URL', f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}')
+
+#Интервал (сек) отложенной записи состояний активных игр в БД. 0 - запись после каждого хода
+GAME_FLUSH_INTERVAL = 1.0
+#Снимок досок активной игры пишется в games раз в столько ходов, остальные ходы - только в журнал moves
+GAME_SNAPSHOT_EVERY = 20
+
+#Размер пула заранее созданных досок и стратегия расстановки кораблей (uniform, edge)
+BOARD_POOL_SIZE = 256
+BOARD_STRATEGY = 'uniform'
+
+#Шина событий вебсокетов между воркерами: 'local' - один воркер, 'postgres' - LISTEN/NOTIFY в БД
+BACKPLANE = 'local'
+
+#Исходящая очередь сокета: размер и политика для медленного клиента (drop, coalesce, disconnect)
+SEND_QUEUE_SIZE = 64
+SLOW_CLIENT_POLICY = 'disconnect'
+
+#Пул соединений БД: постоянные соединения, дополнительные сверх них при пиковой нагрузке,
+#ожидание свободного соединения (сек), пересоздание соединений старше DB_POOL_RECYCLE сек, проверка соединения перед выдачей
+DB_POOL_SIZE = 20
+DB_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT = 10
+DB_POOL_RECYCLE = 1800
+DB_POOL_PRE_PING = True
+
+#Секрет подписи токенов сессии (общий для всех воркеров) и время жизни токена (сек).
+#Без переменной окружения SESSION_SECRET секрет случайный для каждого процесса: токены не переживают перезапуск
+#и не принимаются другими воркерами
+SESSION_SECRET = os.environ.get('SESSION_SECRET')
+if not SESSION_SECRET:
+    SESSION_SECRET = secrets.token_hex(32)
+    print("Warning: SESSION_SECRET is not set, using a random per-process secret")
+SESSION_TTL = 24 * 3600
+
+#Кеш логинов игроков: количество записей и время жизни записи (сек)
+LOGIN_CACHE_SIZE = 10000
+LOGIN_CACHE_TTL = 600
+
+#Буфер последних ходов игры для переподключения (сообщений). Если клиент пропустил больше, он получает снимок игры
+GAME_EVENTS_BUFFER = 64
+
+#Завершение брошенных игр (сек): проверка раз в REAPER_INTERVAL, поражение по таймауту хода при подключенных игроках,
+#поражение (или отмена игры без ходов) при отсутствии подключений, выгрузка из памяти игр без сокетов
+REAPER_INTERVAL = 10
+GAME_TURN_TIMEOUT = 120
+GAME_ABANDON_TIMEOUT = 3600
+GAME_EVICT_AFTER = 60
+
+#Ограничение частоты сообщений сокета игры: сообщений в секунду и допустимая пачка подряд.
+#Сокет, отправивший подряд больше WS_MAX_DROPPED отброшенных сообщений, закрывается
+WS_RATE = 10
+WS_BURST = 20
+WS_MAX_DROPPED = 100
+
+#Размер страницы списков (/players, /games) по умолчанию и наибольший размер страницы по параметру limit
+PAGE_SIZE = 100
+PAGE_MAX_SIZE = 1000
+
+#Максимальное количество игр в одном запросе пакетного создания (/games/create_bulk)
+GAMES_BULK_MAX = 1000
+
+#Архив закончившихся игр: игры, закончившиеся раньше GAME_ARCHIVE_AFTER_DAYS дней назад, переносятся в games_archive
+#пачками по GAME_ARCHIVE_BATCH раз в GAME_ARCHIVE_INTERVAL секунд
+GAME_ARCHIVE_AFTER_DAYS = 30
+GAME_ARCHIVE_INTERVAL = 600
+GAME_ARCHIVE_BATCH = 500
+
+#Зрители игр: задержка ленты событий в секундах и размер очереди сокета зрителя.
+#Отставший зритель вместо накопившихся событий получает один актуальный снимок
+SPECTATOR_DELAY = 3.0
+SPECTATOR_QUEUE_SIZE = 32
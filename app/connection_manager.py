@@ -1,33 +1,311 @@
 from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+from collections import deque
+import asyncio
+import time
+import uuid
+
+from backplane import LocalBackplane
+from metrics import BROADCAST_SECONDS, ERRORS
+
+#Исходящая очередь сокета со своей задачей отправки: медленный клиент не задерживает остальных
+#Политика при переполнении очереди (max_queue сообщений):
+#drop - новое сообщение отбрасывается
+#coalesce - сообщение заменяет ожидающее сообщение с тем же ключом, иначе отбрасывается самое старое сообщение с ключом.
+#Ключ есть только у заменяемых статусных сообщений (старт игры, подключение соперника, ошибки), сообщения без ключа
+#(move_result, game_info) не отбрасываются: если заменить нечего, сокет закрывается
+#disconnect - сокет закрывается
+class Connection:
+    def __init__(self, websocket: WebSocket, game_id: int, max_queue: int, policy: str, on_dead):
+        self.websocket = websocket
+        self.game_id = game_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.on_dead = on_dead
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self.sender())
+
+    #Постановка сообщения в очередь без ожидания отправки
+    def send(self, message, key=None):
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.kill(close=True)
+                return
+            if self.policy == "drop":
+                return
+            if key is not None:
+                for i, (queued_key, _) in enumerate(self.queue):
+                    if queued_key == key:
+                        self.queue[i] = (key, message)
+                        return
+            for i, (queued_key, _) in enumerate(self.queue):
+                if queued_key is not None:
+                    del self.queue[i]
+                    break
+            else:
+                self.kill(close=True)
+                return
+        self.queue.append((key, message))
+        self.ready.set()
+
+    #Замена всех ожидающих сообщений одним (например, актуальным снимком вместо отставших событий)
+    def reset(self, message):
+        if self.closed:
+            return
+        self.queue.clear()
+        self.queue.append((None, message))
+        self.ready.set()
+
+    async def sender(self):
+        try:
+            while True:
+                await self.ready.wait()
+                while self.queue:
+                    _, message = self.queue.popleft()
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    else:
+                        await self.websocket.send_text(message)
+                self.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            #Сокет мертв - убираем его из менеджера
+            self.kill()
+
+    #Остановка отправки. close - закрыть сокет (для медленного клиента)
+    def kill(self, close: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.on_dead(self)
+        if close:
+            asyncio.get_running_loop().create_task(self.close_socket())
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def close_socket(self):
+        try:
+            await self.websocket.close(code=1008)
+        except Exception:
+            pass
 
 #На один id игры два сокета пользователей
+#Сокеты игры могут быть подключены к разным воркерам: бродкаст доставляется локальным сокетам
+#и публикуется в шину (backplane), откуда его получают остальные воркеры
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backplane=None, heartbeat_interval: float = 10.0, max_queue: int = 64, slow_client_policy: str = "disconnect",
+                 handoff_timeout: float = 2.0):
         self.active_connections: dict[int, list[WebSocket]] = {}
-    
+        #Исходящие очереди сокетов
+        self.outboxes: dict[WebSocket, Connection] = {}
+        self.max_queue = max_queue
+        self.slow_client_policy = slow_client_policy
+        self.backplane = backplane or LocalBackplane()
+        self.worker_id = uuid.uuid4().hex
+        self.heartbeat_interval = heartbeat_interval
+        #Количество сокетов игр на других воркерах: id игры -> {id воркера: количество}
+        self.remote_connections: dict[int, dict[str, int]] = {}
+        #Время последнего события от каждого воркера, чтобы забывать упавшие воркеры
+        self.workers_seen: dict[str, float] = {}
+        #Обработчики других видов событий шины: вид -> корутина
+        self.listeners = {}
+        #Время последней активности игры (подключение или сообщение игры на любом воркере): id игры -> time.monotonic()
+        self.activity: dict[int, float] = {}
+        #Передача игры между воркерами. Когда игра этого процесса становится общей, вызывается on_shared(game_id)
+        #(запись незаписанных ходов), затем другие воркеры получают событие flushed.
+        #Подключившийся к общей игре воркер ждет его не дольше handoff_timeout секунд: id игры -> asyncio.Event
+        self.on_shared = None
+        self.handoff_timeout = handoff_timeout
+        self.handoffs: dict[int, asyncio.Event] = {}
+
+    #Подключение к шине. Просим остальные воркеры сообщить о своих подключениях
+    async def start(self):
+        await self.backplane.start(self.on_event)
+        await self.publish({"kind": "sync"})
+
+    async def stop(self):
+        await self.backplane.stop()
+
+    #Подписка на события шины своего вида (kind)
+    def subscribe(self, kind: str, handler):
+        self.listeners[kind] = handler
+
+    async def publish(self, event: dict):
+        event["worker"] = self.worker_id
+        try:
+            await self.backplane.publish(event)
+        except Exception as e:
+            ERRORS.inc("backplane")
+            print(f"Backplane publish error: {e}")
+
     #Создаем подключечение, если его не было
     async def connect(self, websocket: WebSocket, game_id: int):
         await websocket.accept()
         if game_id not in self.active_connections:
             self.active_connections[game_id] = []
         self.active_connections[game_id].append(websocket)
-    
+        self.outboxes[websocket] = Connection(websocket, game_id, self.max_queue, self.slow_client_policy, self.on_dead)
+        self.activity[game_id] = time.monotonic()
+        #Игра уже открыта на другом воркере: его незаписанные ходы нужно дождаться до первой команды
+        if self.is_shared(game_id) and game_id not in self.handoffs:
+            self.handoffs[game_id] = asyncio.Event()
+        await self.publish_presence(game_id)
+
+    #Ожидание записи ходов игры другим воркером после подключения к общей игре
+    async def wait_handoff(self, game_id: int):
+        handoff = self.handoffs.get(game_id)
+        if handoff is None:
+            return
+        try:
+            await asyncio.wait_for(handoff.wait(), self.handoff_timeout)
+        except asyncio.TimeoutError:
+            print(f"Game {game_id} handoff timed out")
+        finally:
+            if self.handoffs.get(game_id) is handoff:
+                del self.handoffs[game_id]
+
     #Убираем сокет игрока при отключении. Если отключились два игрока, удаляем соединение
     def disconnect(self, websocket: WebSocket, game_id: int):
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox is not None:
+            outbox.kill()
         if game_id in self.active_connections:
             try:
                 self.active_connections[game_id].remove(websocket)
                 if len(self.active_connections[game_id]) == 0:
                     del self.active_connections[game_id]
             except ValueError:
-                pass
-    
-    #Личное сообщение
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-    
-    #бродкаст сообщения всем игрокам
-    async def broadcast(self, message: str, game_id: int):
-        if game_id in self.active_connections:
-            for connection in self.active_connections[game_id]:
-                await connection.send_text(message)
\ No newline at end of file
+                return
+            asyncio.get_running_loop().create_task(self.publish_presence(game_id))
+
+    #Количество подключений к игре на всех воркерах
+    def connection_count(self, game_id: int):
+        local = len(self.active_connections.get(game_id, []))
+        return local + sum(self.remote_connections.get(game_id, {}).values())
+
+    #К игре подключены сокеты других воркеров
+    def is_shared(self, game_id: int):
+        return bool(self.remote_connections.get(game_id))
+
+    async def publish_presence(self, game_id: int):
+        await self.publish({
+            "kind": "presence",
+            "game_id": game_id,
+            "count": len(self.active_connections.get(game_id, []))
+        })
+
+    #Сокет не принимает сообщения (ошибка отправки или переполнена очередь) - убираем его
+    def on_dead(self, outbox: Connection):
+        self.disconnect(outbox.websocket, outbox.game_id)
+
+    #Личное сообщение (строка или бинарный кадр). key - ключ заменяемого сообщения для политики coalesce
+    async def send_personal_message(self, message, websocket: WebSocket, key: str = None):
+        outbox = self.outboxes.get(websocket)
+        if outbox is not None:
+            outbox.send(message, key)
+
+    #бродкаст сообщения всем игрокам. В шину сообщение публикуется, только если к игре подключены сокеты других воркеров
+    async def broadcast(self, message: str, game_id: int, key: str = None):
+        start = time.perf_counter()
+        self.activity[game_id] = time.monotonic()
+        await self.send_local(message, game_id, key)
+        if self.is_shared(game_id):
+            await self.publish({"kind": "message", "game_id": game_id, "message": message, "key": key})
+        BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+    #Сообщение ставится в очереди всех сокетов игры, отправка идет параллельно в задачах сокетов.
+    #Список копируется: переполненный сокет при отправке удаляется из подключений игры
+    async def send_local(self, message: str, game_id: int, key: str = None):
+        for websocket in list(self.active_connections.get(game_id, [])):
+            outbox = self.outboxes.get(websocket)
+            if outbox is not None:
+                outbox.send(message, key)
+
+    #Обработка событий других воркеров
+    async def on_event(self, event: dict):
+        worker = event.get("worker")
+        if worker == self.worker_id:
+            return
+        self.workers_seen[worker] = time.monotonic()
+
+        if event["kind"] == "message":
+            self.activity[event["game_id"]] = time.monotonic()
+            await self.send_local(event["message"], event["game_id"], event.get("key"))
+
+        elif event["kind"] == "presence":
+            counts = self.remote_connections.setdefault(event["game_id"], {})
+            if event["count"]:
+                shared = not counts
+                counts[worker] = event["count"]
+                #Игра с сокетами этого процесса стала общей: записываем ее ходы и сообщаем об этом
+                if shared and event["game_id"] in self.active_connections:
+                    await self.hand_off(event["game_id"])
+            else:
+                counts.pop(worker, None)
+                if not counts:
+                    del self.remote_connections[event["game_id"]]
+
+        elif event["kind"] == "flushed":
+            handoff = self.handoffs.get(event["game_id"])
+            if handoff is not None:
+                handoff.set()
+
+        elif event["kind"] == "sync":
+            for game_id in list(self.active_connections):
+                await self.publish_presence(game_id)
+
+        elif event["kind"] in self.listeners:
+            await self.listeners[event["kind"]](event)
+
+    async def hand_off(self, game_id: int):
+        if self.on_shared is not None:
+            try:
+                await self.on_shared(game_id)
+            except Exception as e:
+                ERRORS.inc("handoff")
+                print(f"Game {game_id} handoff error: {e}")
+                return
+        await self.publish({"kind": "flushed", "game_id": game_id})
+
+    #Закрытие всех сокетов игры в этом процессе (игра закончилась, а клиенты не отключились)
+    def close_game(self, game_id: int):
+        for websocket in list(self.active_connections.get(game_id, [])):
+            outbox = self.outboxes.get(websocket)
+            if outbox is not None:
+                outbox.kill(close=True)
+            else:
+                self.disconnect(websocket, game_id)
+
+    #Удаление сокетов, которые уже закрыты, но остались в списках подключений
+    def prune(self):
+        for game_id in list(self.active_connections):
+            for websocket in list(self.active_connections.get(game_id, [])):
+                if (websocket not in self.outboxes
+                        or websocket.client_state == WebSocketState.DISCONNECTED
+                        or websocket.application_state == WebSocketState.DISCONNECTED):
+                    self.disconnect(websocket, game_id)
+
+    #Удаляем подключения воркеров, от которых давно не было событий
+    def forget_workers(self, before: float):
+        for worker in [worker for worker, seen in self.workers_seen.items() if seen < before]:
+            del self.workers_seen[worker]
+            for game_id in list(self.remote_connections):
+                counts = self.remote_connections[game_id]
+                counts.pop(worker, None)
+                if not counts:
+                    del self.remote_connections[game_id]
+
+    #Фоновая задача: периодически подтверждаем свои подключения и забываем пропавшие воркеры
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for game_id in list(self.active_connections):
+                await self.publish_presence(game_id)
+            await self.publish({"kind": "heartbeat"})
+            self.forget_workers(time.monotonic() - 3 * self.heartbeat_interval)
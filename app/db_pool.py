@@ -0,0 +1,44 @@
+import time
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+#Пул соединений БД с учетом времени ожидания соединения.
+#Время ожидания - от запроса соединения у пула до его получения (включая открытие нового соединения)
+class MeteredPool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            self.waits += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    #Пул пересоздается движком (dispose) - счетчики переносятся в новый пул
+    def recreate(self):
+        pool = super().recreate()
+        pool.waits, pool.wait_total, pool.wait_max = self.waits, self.wait_total, self.wait_max
+        return pool
+
+#Показатели пула: размер, занятые соединения, соединения сверх размера, время ожидания соединения (мс)
+def pool_metrics(pool):
+    metrics = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0)
+    }
+    if isinstance(pool, MeteredPool):
+        metrics.update(
+            waits=pool.waits,
+            wait_avg_ms=round(pool.wait_total / pool.waits * 1000, 3) if pool.waits else 0.0,
+            wait_max_ms=round(pool.wait_max * 1000, 3)
+        )
+    return metrics
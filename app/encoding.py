@@ -0,0 +1,53 @@
+import json
+
+#Быстрый JSON-кодировщик, если установлен orjson
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#Сообщение сериализуется один раз, одна и та же строка ставится в очереди всех получателей
+def encode_message(message: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message)
+
+#Бинарный кадр досок: байт типа кадра + по 100 байт на доску (значение клетки desk[x][y] в байте x * 10 + y, со знаком)
+BOARDS_FRAME = 1
+
+def encode_boards(board1, board2) -> bytes:
+    data = bytearray([BOARDS_FRAME])
+    for board in (board1, board2):
+        for line in board:
+            data.extend(value & 0xFF for value in line)
+    return bytes(data)
+
+def decode_boards(data: bytes):
+    values = [value - 256 if value > 127 else value for value in data[1:]]
+    boards = []
+    for start in (0, 100):
+        boards.append([values[start + x * 10:start + x * 10 + 10] for x in range(10)])
+    return boards[0], boards[1]
+
+#Закодированный снимок game_info для версии состояния игры. Переиспользуется при повторных подключениях,
+#пока состояние игры не изменилось
+class Snapshot:
+    def __init__(self, version: int, info: dict, desk: dict):
+        self.version = version
+        self.info = info
+        self.desk = desk
+        self.text = None
+        self.binary = None
+
+    #Кадры для отправки: JSON с досками или JSON без досок + бинарный кадр досок
+    def frames(self, binary: bool = False):
+        if binary:
+            if self.binary is None:
+                self.binary = (
+                    encode_message({**self.info, "boards": "binary"}),
+                    encode_boards(self.desk["player1"], self.desk["player2"])
+                )
+            return list(self.binary)
+        if self.text is None:
+            self.text = encode_message({**self.info, "board1": self.desk["player1"], "board2": self.desk["player2"]})
+        return [self.text]
@@ -1,59 +1,160 @@
+import json
 import random
 
+#Состав флота: длина корабля -> количество. Корабли нумеруются от 1 начиная с самого крупного
+SHIPS = {
+    4: 1,
+    3: 2,
+    2: 3,
+    1: 4
+}
+
+#Битовые доски: поле 10 на 10 хранится как 100-битное целое, клетке desk[row][col] соответствует бит row * 10 + col
+def cell_bit(row, col):
+    return 1 << (row * 10 + col)
+
+#Клетки корабля. None, если корабль выходит за пределы поля
+def ship_place_cells(ship_length, row, col, horizontal):
+    if not (0 <= row < 10 and 0 <= col < 10):
+        return None
+    if horizontal:
+        if col + ship_length > 10:
+            return None
+        return [(row, col + i) for i in range(ship_length)]
+    if row + ship_length > 10:
+        return None
+    return [(row + i, col) for i in range(ship_length)]
+
+#Заранее считаем для каждого положения (длина, строка, столбец, направление) маску корабля
+#и маску запретной зоны (корабль + соседние клетки): положение допустимо, если зона не пересекается с занятыми клетками
+SHIP_MASKS = {}
+ZONE_MASKS = {}
+#Все положения корабля каждой длины: (строка, столбец, направление, маска корабля, маска зоны)
+PLACEMENTS = {}
+
+for ship_length in range(1, 5):
+    PLACEMENTS[ship_length] = []
+    for row in range(10):
+        for col in range(10):
+            for horizontal in (True, False):
+                cells = ship_place_cells(ship_length, row, col, horizontal)
+                if cells is None:
+                    continue
+                ship_mask = 0
+                zone_mask = 0
+                for r, c in cells:
+                    ship_mask |= cell_bit(r, c)
+                    for dr in [-1, 0, 1]: # верх, ряд клетки, низ
+                        for dc in [-1, 0, 1]: # лево, столбец клетки, право
+                            if 0 <= r + dr < 10 and 0 <= c + dc < 10:
+                                zone_mask |= cell_bit(r + dr, c + dc)
+                key = (ship_length, row, col, horizontal)
+                SHIP_MASKS[key] = ship_mask
+                ZONE_MASKS[key] = zone_mask
+                #Корабль длины 1 одинаков в обоих направлениях, в перечень положений попадает один раз
+                if ship_length > 1 or horizontal:
+                    PLACEMENTS[ship_length].append((row, col, horizontal, ship_mask, zone_mask))
+
 #Создание матрицы игрового поля 10 на 10
 def create_empty_desk():
     return [[0 for _ in range(10)] for _ in range(10)]
 
-#Проверка возможность разместить корабль
+#Маска занятых клеток доски (любое ненулевое значение)
+def desk_to_mask(desk):
+    mask = 0
+    for row in range(10):
+        for col in range(10):
+            if desk[row][col] != 0:
+                mask |= cell_bit(row, col)
+    return mask
+
+#Перевод доски в битовые маски кораблей: индекс корабля -> маска его клеток
+def desk_to_bitboards(desk):
+    ships = {}
+    for row in range(10):
+        for col in range(10):
+            index = desk[row][col]
+            if index > 0:
+                ships[index] = ships.get(index, 0) | cell_bit(row, col)
+    return ships
+
+#Перевод битовых масок кораблей в доску списков
+def bitboards_to_desk(ships):
+    desk = create_empty_desk()
+    for index, mask in ships.items():
+        while mask:
+            low = mask & -mask
+            bit = low.bit_length() - 1
+            desk[bit // 10][bit % 10] = index
+            mask ^= low
+    return desk
+
+#Проверка возможность разместить корабль: одна операция И маски запретной зоны с занятыми клетками
 def can_place_ship(desk, ship_length, row, col, horizontal):
-    if horizontal:
-        #Нельзя выходить за пределы поля
-        if col + ship_length > 10:
-            return False
-        #Проверка места размещения корабля
-        for i in range(ship_length):
-            if desk[row][col + i] != 0:
-                return False
-            #Проверка клеток вокруг корабля
-            for dr in [-1, 0, 1]: # верх, ряд клетки, низ
-                for dc in [-1, 0, 1]: # лево, столбец клетки, право
-                    if 0 <= row + dr < 10 and 0 <= col + i + dc < 10: #проверяемая клетка должна быть в пределах поля
-                        if desk[row + dr][col + i + dc] != 0 and not (dr == 0 and dc == 0): #проверка занятости соседней клетки
-                            return False
-    else:
-        #Нельзя выходить за пределы поля
-        if row + ship_length > 10:
-            return False
-        #Проверка места размещения корабля
-        for i in range(ship_length):
-            if desk[row + i][col] != 0:
-                return False
-            #Проверка клеток вокруг корабля
-            for dr in [-1, 0, 1]:
-                for dc in [-1, 0, 1]:
-                    if 0 <= row + i + dr < 10 and 0 <= col + dc < 10:
-                        if desk[row + i + dr][col + dc] != 0 and not (dr == 0 and dc == 0):
-                            return False
-        return True
-
-#размещение корабля
+    zone_mask = ZONE_MASKS.get((ship_length, row, col, horizontal))
+    if zone_mask is None: #Нельзя выходить за пределы поля
+        return False
+    return not (desk_to_mask(desk) & zone_mask)
+
+#Все допустимые положения корабля при занятых клетках occupied
+def legal_placements(occupied, ship_length, horizontal=None):
+    return [
+        placement for placement in PLACEMENTS[ship_length]
+        if not (occupied & placement[4]) and (horizontal is None or placement[2] == horizontal)
+    ]
+
+#размещение корабля: равновероятный выбор среди допустимых положений
 def place_ship(desk, ship_length, ship_number, horizontal):
-        attempts = 0
-        while attempts < 100:  #Выбор случайной клетки на поле до ограничителя
-            row = random.randint(0, 9)
-            col = random.randint(0, 9)
-            
-            if can_place_ship(desk, ship_length, row, col, horizontal):
-                if horizontal:
-                    for i in range(ship_length):
-                        desk[row][col + i] = ship_number
-                else:
-                    for i in range(ship_length):
-                        desk[row + i][col] = ship_number
-                return True
-            attempts += 1
+    legal = legal_placements(desk_to_mask(desk), ship_length, horizontal)
+    if not legal:
         return False
+    row, col, horizontal, _, _ = random.choice(legal)
+    for r, c in ship_place_cells(ship_length, row, col, horizontal):
+        desk[r][c] = ship_number
+    return True
+
+#Клетки по краю поля
+EDGE_MASK = 0
+for i in range(10):
+    EDGE_MASK |= cell_bit(0, i) | cell_bit(9, i) | cell_bit(i, 0) | cell_bit(i, 9)
 
+#Стратегии выбора положения корабля: получают список допустимых положений и генератор случайных чисел
+#Равновероятный выбор
+def uniform_strategy(legal, rng):
+    return rng.choice(legal)
+
+#Предпочтение краев поля: вес положения растет с количеством клеток корабля у края
+def edge_strategy(legal, rng):
+    weights = [1 + 3 * (placement[3] & EDGE_MASK).bit_count() for placement in legal]
+    return rng.choices(legal, weights)[0]
+
+STRATEGIES = {
+    "uniform": uniform_strategy,
+    "edge": edge_strategy
+}
+
+#Размещение флота на битовой доске перебором с возвратом: если следующему кораблю негде встать,
+#положение текущего корабля исключается и выбирается другое. Возвращает маски кораблей по индексам
+def fleet_bitboards(strategy=uniform_strategy, rng=random):
+    lengths = [ship_length for ship_length, count in SHIPS.items() for _ in range(count)]
+
+    def place(i, occupied):
+        if i == len(lengths):
+            return []
+        legal = legal_placements(occupied, lengths[i])
+        while legal:
+            placement = strategy(legal, rng)
+            rest = place(i + 1, occupied | placement[3])
+            if rest is not None:
+                return [placement[3]] + rest
+            legal.remove(placement)
+        return None
+
+    masks = place(0, 0)
+    #Перебор полный, поэтому флот не помещается только при некорректном составе SHIPS
+    if masks is None:
+        raise RuntimeError("Fleet does not fit on the desk")
+    return {ship_number: mask for ship_number, mask in enumerate(masks, start=1)}
 
 #создание доски
 #корабли пронумерованы от 1 до 10 начиная с самого крупного корабля (4 клетки)
@@ -63,37 +164,94 @@ def place_ship(desk, ship_length, ship_number, horizontal):
 #2 корабля длиной 3
 #3 корабля длиной 2
 #4 корабля длиной 1
-def desk_create():       
-    player_desk = create_empty_desk()
-    
-    ships = {
-        4: 1,
-        3: 2,
-        2: 3,  
-        1: 4   
+#Всегда возвращает полный флот. strategy - имя стратегии из STRATEGIES, rng - генератор (random.Random(seed) для повторяемых досок)
+def desk_create(strategy="uniform", rng=random):
+    return bitboards_to_desk(fleet_bitboards(STRATEGIES[strategy], rng))
+
+#Упаковка двух досок для хранения в БД: байт формата + 100 байт, по 4 бита на клетку (значение + 1, от -1 до 10)
+DESK_FORMAT_NIBBLE = 1
+NIBBLE_PAIRS = [((byte >> 4) - 1, (byte & 15) - 1) for byte in range(256)]
+
+def pack_desk(desk):
+    cells = [value + 1 for key in ("player1", "player2") for line in desk[key] for value in line]
+    data = bytearray([DESK_FORMAT_NIBBLE])
+    data.extend(cells[i] << 4 | cells[i + 1] for i in range(0, 200, 2))
+    return bytes(data)
+
+def unpack_desk(data):
+    if data[0] != DESK_FORMAT_NIBBLE:
+        raise ValueError(f"Unknown desk format {data[0]}")
+    cells = []
+    for byte in data[1:]:
+        cells.extend(NIBBLE_PAIRS[byte])
+    boards = [[cells[start + x * 10:start + x * 10 + 10] for x in range(10)] for start in (0, 100)]
+    return {
+        "player1": boards[0],
+        "player2": boards[1]
     }
-    
-    ship_number = 1
-    
-    #Размещаем корабли для первого игрока
-    for ship_length, count in ships.items():
-        for _ in range(count):
-            placed = False
-            attempts = 0
-            while not placed and attempts < 100:
-                horizontal = random.choice([True, False]) #направление корабля
-                placed = place_ship(player_desk, ship_length, ship_number, horizontal)
-                attempts += 1
-            if placed:
-                ship_number += 1
-
-    return player_desk
-
-#упаковка двух досок
-def get_desks():
-    player1_desk = desk_create()
-    player2_desk = desk_create()
+
+#Доски из упакованной колонки, а для старых игр - из JSON-колонки (JSON-строка внутри JSON)
+def load_desk(data, legacy=None):
+    if data is not None:
+        return unpack_desk(data)
+    if legacy is None:
+        return None
+    return json.loads(legacy) if isinstance(legacy, str) else legacy
+
+#упаковка двух досок. При заданном seed доски детерминированы
+def get_desks(strategy="uniform", seed=None):
+    rng = random.Random(seed) if seed is not None else random
+    player1_desk = desk_create(strategy, rng)
+    player2_desk = desk_create(strategy, rng)
     return {
         "player1": player1_desk,
         "player2": player2_desk
     }
+
+#Флот на доске: клетки и оставшиеся жизни каждого корабля (индекс 1-10 из desk_create), общее количество целых клеток
+#Проверки уничтожения корабля и конца игры - уменьшение счетчиков без обхода доски
+#Жизни считаются по текущей доске, клетки кораблей - по начальной доске initial_desk.
+#Без начальной доски уже подбитые (-1) клетки в корабли не попадают
+class Fleet:
+    def __init__(self, desk, initial_desk=None):
+        self.cells = {}
+        self.hp = {}
+        for x, line in enumerate(desk):
+            for y, index in enumerate(line):
+                if index > 0:
+                    self.hp[index] = self.hp.get(index, 0) + 1
+                    if initial_desk is None:
+                        self.cells.setdefault(index, []).append((x, y))
+        if initial_desk is not None:
+            for x, line in enumerate(initial_desk):
+                for y, index in enumerate(line):
+                    if index > 0:
+                        self.cells.setdefault(index, []).append((x, y))
+            for index in self.cells:
+                self.hp.setdefault(index, 0)
+        self.alive = sum(self.hp.values())
+
+    #Попадание в корабль с индексом. Возвращает True, если корабль уничтожен
+    def hit(self, ship_index):
+        self.hp[ship_index] -= 1
+        self.alive -= 1
+        return self.hp[ship_index] == 0
+
+    #Все корабли уничтожены
+    def destroyed(self):
+        return self.alive == 0
+
+    #Клетки корабля
+    def ship_cells(self, ship_index):
+        return list(self.cells.get(ship_index, []))
+
+    #Клетки вокруг корабля в пределах поля (после уничтожения корабля в них не может быть других кораблей)
+    def ship_ring(self, ship_index):
+        cells = set(self.cells.get(ship_index, []))
+        ring = set()
+        for x, y in cells:
+            for dx in [-1, 0, 1]:
+                for dy in [-1, 0, 1]:
+                    if 0 <= x + dx < 10 and 0 <= y + dy < 10 and (x + dx, y + dy) not in cells:
+                        ring.add((x + dx, y + dy))
+        return sorted(ring)
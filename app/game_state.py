@@ -0,0 +1,376 @@
+import asyncio
+from collections import deque
+from contextlib import AsyncExitStack
+
+from sqlalchemy import update, insert, null
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from models import Game, Move
+from game_logic import Fleet, pack_desk, load_desk
+from stats import record_game
+from metrics import ERRORS
+
+#Результат хода в журнале ходов
+MOVE_MISS = 0
+MOVE_HIT = 1
+MOVE_KILL = 2
+
+#Игру изменил другой процесс
+class GameConflict(Exception):
+    pass
+
+#Состояние активной игры в памяти процесса.
+#Пока игра идет, ходы проверяются и применяются здесь, а в БД отложенно дописываются в журнал ходов (moves)
+#Команды игры выполняются по очереди под lock, другие игры при этом не блокируются
+class GameState:
+    def __init__(self, game_id: int, player1_id: int, player2_id: int, current_turn: int, desk: dict,
+                 row_version: int = 0, initial_desk: dict = None, seq: int = 0, events_size: int = 64):
+        self.game_id = game_id
+        self.player1_id = player1_id
+        self.player2_id = player2_id
+        self.lock = asyncio.Lock()
+        #Запись в БД: пока ходы отправлены одной записью и не отмечены записанными, другая запись их не берет
+        self.write_lock = asyncio.Lock()
+        #Версия состояния (растет с каждым ходом), закодированный снимок game_info для нее и логины игроков
+        self.version = 0
+        self.snapshot = None
+        self.logins = None
+        #Последние события игры для переподключения: (номер хода, закодированное сообщение move_result)
+        self.events = deque(maxlen=events_size)
+        #Игра записана законченной (GameStateStore.finish): команды, ждавшие lock, к состоянию не применяются
+        self.finished = False
+        self.load(current_turn, desk, row_version, initial_desk, seq)
+
+    #Состояние из строки Game (снимок досок) и ходов, сделанных после снимка
+    @classmethod
+    def from_game(cls, game: Game, moves=(), events_size: int = 64):
+        state = cls(game.id, game.player1_id, game.player2_id, game.current_turn, load_desk(game.desk_data, game.desk),
+                    game.version, load_desk(game.initial_desk_data, game.initial_desk), game.snapshot_seq, events_size)
+        state.replay(moves)
+        return state
+
+    #Загрузка снимка досок и хода. row_version - версия строки Game в БД, seq - номер последнего хода в снимке
+    def load(self, current_turn: int, desk: dict, row_version: int, initial_desk: dict = None, seq: int = 0):
+        self.current_turn = current_turn
+        self.desk = desk
+        self.row_version = row_version
+        self.initial_desk = initial_desk
+        #Флоты досок: жизни кораблей и общее количество целых клеток. Клетки кораблей берутся с начальных досок
+        self.fleets = {
+            key: Fleet(desk[key], initial_desk[key] if initial_desk else None)
+            for key in ("player1", "player2")
+        }
+        #Победитель: игрок, уничтоживший весь флот соперника. После этого ходы не принимаются
+        self.winner = None
+        if self.fleets["player2"].destroyed():
+            self.winner = self.player1_id
+        elif self.fleets["player1"].destroyed():
+            self.winner = self.player2_id
+        #Номер последнего хода и номер хода, на котором записан снимок досок в строке Game
+        self.seq = seq
+        self.snapshot_seq = seq
+        #Ходы, которые еще не записаны в БД
+        self.pending_moves = []
+        self.events.clear()
+        self.version += 1
+
+    #Применение ходов из журнала. Сообщений об этих ходах в буфере событий нет, поэтому буфер очищается
+    def replay(self, moves):
+        for move in moves:
+            self.move(move.player_id, move.col, move.row)
+        self.pending_moves = []
+        if moves:
+            self.events.clear()
+
+    #Сообщение о последнем ходе в буфер событий
+    def record_event(self, message):
+        self.events.append((self.seq, message))
+
+    #Сообщения о ходах после хода seq или None, если буфер их уже (или еще) не содержит
+    def events_after(self, seq: int):
+        if seq == self.seq:
+            return []
+        if not self.events or self.events[-1][0] != self.seq or not self.events[0][0] <= seq + 1 <= self.seq:
+            return None
+        return [message for event_seq, message in self.events if event_seq > seq]
+
+    #Есть изменения, которые еще не записаны в БД
+    @property
+    def dirty(self):
+        return bool(self.pending_moves)
+
+    def is_player(self, player_id: int):
+        return player_id == self.player1_id or player_id == self.player2_id
+
+    #Игрок уже стрелял в эту клетку доски соперника
+    def already_shot(self, player_id: int, col: int, row: int):
+        target = "player2" if player_id == self.player1_id else "player1"
+        return self.desk[target][col][row] == -1
+
+    #Выстрел игрока по доске соперника. Возвращает None, если сейчас не ход игрока или игра уже выиграна
+    def move(self, player_id: int, col: int, row: int):
+        if player_id != self.current_turn or self.winner is not None:
+            return None
+
+        #По какой доске стреляем
+        target = "player2" if player_id == self.player1_id else "player1"
+        board = self.desk[target]
+
+        #Получаем значение в месте попадания и отмечаем выстрел
+        hit_place = board[col][row]
+        board[col][row] = -1
+
+        is_hit = hit_place > 0
+        kill = False
+        game_over = False
+        result = {}
+        if is_hit:
+            #Снимаем кораблю одну жизнь. Корабль без жизней уничтожен, флот без целых клеток - конец игры
+            fleet = self.fleets[target]
+            kill = fleet.hit(hit_place)
+            game_over = fleet.destroyed()
+            if game_over:
+                self.winner = player_id
+            #Для уничтоженного корабля отдаем его клетки и клетки вокруг него (col, row)
+            if kill:
+                result["ship_cells"] = fleet.ship_cells(hit_place)
+                result["ring_cells"] = fleet.ship_ring(hit_place)
+        else:
+            #Если промах, то происходит смена хода
+            self.current_turn = self.player2_id if self.current_turn == self.player1_id else self.player1_id
+
+        #Ход в очередь записи журнала
+        self.seq += 1
+        self.pending_moves.append({
+            "game_id": self.game_id,
+            "seq": self.seq,
+            "player_id": player_id,
+            "col": col,
+            "row": row,
+            "result": MOVE_KILL if kill else MOVE_HIT if is_hit else MOVE_MISS
+        })
+        self.version += 1
+        result.update(hit=is_hit, kill=kill, game_over=game_over)
+        return result
+
+    #Значения полей снимка в строке Game
+    def to_row(self):
+        return {
+            "desk_data": pack_desk(self.desk),
+            "desk": null(),
+            "current_turn": self.current_turn,
+            "snapshot_seq": self.seq
+        }
+
+#Хранилище состояний активных игр процесса с отложенной (write-behind) записью в БД.
+#Каждый ход - одна узкая строка в moves, снимок досок в games пишется раз в snapshot_every ходов
+class GameStateStore:
+    def __init__(self, session_factory, flush_interval: float, snapshot_every: int = 20, events_size: int = 64):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.events_size = events_size
+        self.games: dict[int, GameState] = {}
+        #in_use(game_id) - к игре подключены сокеты этого процесса: такая игра из памяти не выгружается
+        self.in_use = None
+
+    #Ходы игры после хода seq
+    async def moves_after(self, db, game_id: int, seq: int):
+        result = await db.execute(select(Move).where(Move.game_id == game_id, Move.seq > seq).order_by(Move.seq))
+        return result.scalars().all()
+
+    #Получение состояния игры. Если игры нет в памяти, загружаем ее из БД
+    async def get(self, game_id: int):
+        state = self.games.get(game_id)
+        if state is not None:
+            return state
+
+        state = await self.load(game_id)
+        if state is None:
+            return None
+        #Пока шел запрос, игру мог загрузить другой игрок
+        return self.games.setdefault(game_id, state)
+
+    #Чтение состояния игры из БД (снимок + ходы после него) без добавления в память процесса.
+    #Закончившиеся игры не загружаем
+    async def load(self, game_id: int):
+        async with self.session_factory() as db:
+            result = await db.execute(select(Game).where(Game.id == game_id, Game.date_ended.is_(None)))
+            game = result.scalar_one_or_none()
+            if not game:
+                return None
+            moves = await self.moves_after(db, game_id, game.snapshot_seq)
+        return GameState.from_game(game, moves, self.events_size)
+
+    #Запись в текущей транзакции: новые ходы всех игр одним INSERT, снимки досок - с проверкой версии (compare-and-swap)
+    #Возвращает то, что нужно отметить в состояниях после фиксации транзакции
+    async def write(self, db, states, snapshot: bool = False, **values):
+        written = []
+        moves = []
+        for state in states:
+            need_snapshot = snapshot or state.seq - state.snapshot_seq >= self.snapshot_every
+            written.append((state, len(state.pending_moves), need_snapshot, state.seq))
+            moves.extend(state.pending_moves)
+
+        try:
+            if moves:
+                await db.execute(insert(Move), moves)
+            for state, _, need_snapshot, _ in written:
+                if not need_snapshot:
+                    continue
+                result = await db.execute(
+                    update(Game)
+                    .where(Game.id == state.game_id, Game.version == state.row_version)
+                    .values(version=state.row_version + 1, **state.to_row(), **values)
+                )
+                if result.rowcount != 1:
+                    raise GameConflict(state.game_id)
+        except IntegrityError:
+            #Ход с таким номером уже записал другой процесс
+            raise GameConflict()
+        return written
+
+    #Отметка записанного после фиксации транзакции. Ходы, сделанные во время записи, остаются в очереди
+    def written(self, written):
+        for state, count, need_snapshot, seq in written:
+            del state.pending_moves[:count]
+            if need_snapshot:
+                state.snapshot_seq = seq
+                state.row_version += 1
+
+    #Запись измененных игр в БД в одной транзакции.
+    #При периодической записи пропускаются игры, команда или запись которых выполняется прямо сейчас
+    async def flush(self, game_ids=None):
+        if game_ids is None:
+            states = [
+                state for state in self.games.values()
+                if state.dirty and not state.lock.locked() and not state.write_lock.locked()
+            ]
+        else:
+            states = [self.games[game_id] for game_id in sorted(game_ids) if game_id in self.games]
+        if not states:
+            return
+
+        async with AsyncExitStack() as stack:
+            for state in states:
+                await stack.enter_async_context(state.write_lock)
+            #Пока ждали, ходы могла записать другая запись
+            states = [state for state in states if state.dirty]
+            if states:
+                await self.write_flush(states)
+
+    async def write_flush(self, states):
+        conflicts = []
+        async with self.session_factory() as db:
+            try:
+                written = await self.write(db, states)
+                await db.commit()
+            except GameConflict:
+                #Пишем игры по одной, чтобы найти ту, которую изменил другой процесс
+                await db.rollback()
+                written = []
+                for state in states:
+                    try:
+                        async with db.begin_nested():
+                            written.extend(await self.write(db, [state]))
+                    except GameConflict:
+                        conflicts.append(state)
+                await db.commit()
+        self.written(written)
+
+        #Игру изменил другой процесс: забываем свою копию, при следующем обращении она перечитается из БД
+        for state in conflicts:
+            print(f"Game {state.game_id} was changed by another process, reloading")
+            if self.games.get(state.game_id) is state:
+                del self.games[state.game_id]
+
+    #Дописывание в состояние ходов, записанных другим процессом (game - строка Game из той же транзакции)
+    async def sync(self, db, state: GameState, game: Game):
+        remote_moves = await self.moves_after(db, state.game_id, state.seq)
+        if remote_moves and not state.dirty and game.version == state.row_version:
+            state.replay(remote_moves)
+        elif remote_moves or game.version != state.row_version:
+            #Состояние разошлось с БД: перечитываем снимок и журнал, свои незаписанные ходы теряются
+            if state.dirty:
+                print(f"Game {state.game_id} was changed by another process, dropping local moves")
+            state.load(game.current_turn, load_desk(game.desk_data, game.desk), game.version,
+                       load_desk(game.initial_desk_data, game.initial_desk), game.snapshot_seq)
+            state.replay(await self.moves_after(db, state.game_id, game.snapshot_seq))
+
+    #Обновление состояния из БД после передачи игры другим процессом (он уже записал свои ходы)
+    async def refresh(self, state: GameState):
+        async with state.write_lock, self.session_factory() as db:
+            result = await db.execute(select(Game).where(Game.id == state.game_id))
+            game = result.scalar_one_or_none()
+            if game is not None:
+                await self.sync(db, state, game)
+
+    #Выполнение команды над игрой, подключенной к нескольким процессам: строка блокируется (SELECT ... FOR UPDATE),
+    #ходы другого процесса дописываются в состояние, результат команды записывается сразу
+    async def apply_locked(self, state: GameState, command):
+        async with state.write_lock, self.session_factory() as db:
+            result = await db.execute(select(Game).where(Game.id == state.game_id).with_for_update())
+            game = result.scalar_one()
+            await self.sync(db, state, game)
+            result = command()
+            written = await self.write(db, [state])
+            await db.commit()
+            self.written(written)
+        return result
+
+    #Запись игры и удаление ее из памяти. Запись идет под lock игры, команды ждут ее окончания.
+    #Если за время записи к игре подключились или сделали ход, состояние остается в памяти
+    async def evict(self, game_id: int):
+        state = self.games.get(game_id)
+        if state is None:
+            return
+        async with state.lock:
+            await self.flush([game_id])
+            if self.games.get(game_id) is not state or state.dirty:
+                return
+            if self.in_use is not None and self.in_use(game_id):
+                return
+            del self.games[game_id]
+
+    #Завершение игры: строка блокируется (SELECT ... FOR UPDATE), чтобы игру не завершили дважды, и ходы другого процесса
+    #дописываются в состояние, как в apply_locked. Победитель выбирается по актуальному состоянию: игрок, уничтоживший флот
+    #соперника, а при forfeit (reaper) - соперник игрока, за которым ход; игра без ходов отменяется без победителя.
+    #Записываются ходы, итоговый снимок досок, дата окончания и победитель, в той же транзакции - сводки статистики обоих игроков.
+    #Возвращает False, если игру уже завершил другой процесс или она еще не выиграна (без forfeit). Победитель - state.winner
+    #Состояние отмечается законченным и удаляется из памяти только после успешной записи: при ошибке несохраненные ходы остаются
+    async def finish(self, state: GameState, date_ended, forfeit: bool = False):
+        async with state.write_lock, self.session_factory() as db:
+            result = await db.execute(select(Game).where(Game.id == state.game_id).with_for_update())
+            game = result.scalar_one()
+            if game.date_ended is not None:
+                state.finished = True
+                self.games.pop(state.game_id, None)
+                return False
+            await self.sync(db, state, game)
+
+            winner_id = state.winner
+            if winner_id is None:
+                if not forfeit:
+                    return False
+                if state.seq:
+                    winner_id = state.player2_id if state.current_turn == state.player1_id else state.player1_id
+            written = await self.write(db, [state], snapshot=True, date_ended=date_ended, winner_id=winner_id)
+            if winner_id is not None:
+                await record_game(db, state.player1_id, state.player2_id, winner_id, state.seq, game.date_created, date_ended)
+            await db.commit()
+            self.written(written)
+        state.winner = winner_id
+        state.finished = True
+        self.games.pop(state.game_id, None)
+        return True
+
+    #Фоновая задача периодической записи
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                ERRORS.inc("flush")
+                print(f"Game state flush error: {e}")
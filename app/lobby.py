@@ -0,0 +1,117 @@
+import asyncio
+from collections import OrderedDict
+
+from fastapi import WebSocket
+from sqlalchemy.future import select
+
+from models import Game
+from encoding import encode_message
+
+#Присутствие игроков: кто занят в активной игре. Загружается из БД один раз при старте,
+#дальше поддерживается при создании и завершении игр. Другие воркеры узнают об изменениях через шину менеджера
+class Presence:
+    def __init__(self, manager):
+        self.manager = manager
+        #id игрока -> id активной игры
+        self.busy: dict[int, int] = {}
+        #Игроки, для которых сейчас создается игра в этом процессе (проверка пройдена, строка игры еще не записана)
+        self.reserved: set[int] = set()
+        manager.subscribe("player_busy", self.on_busy)
+        manager.subscribe("player_free", self.on_free)
+        manager.subscribe("players_busy", self.on_busy_many)
+
+    async def load(self, session_factory):
+        async with session_factory() as db:
+            result = await db.execute(
+                select(Game.id, Game.player1_id, Game.player2_id).where(Game.date_ended.is_(None))
+            )
+            for game_id, player1_id, player2_id in result.all():
+                self.busy[player1_id] = game_id
+                self.busy[player2_id] = game_id
+
+    def is_busy(self, player_id: int):
+        return player_id in self.busy or player_id in self.reserved
+
+    #Резерв игроков до записи игры: вызывается сразу после проверки занятости, без await между ними,
+    #чтобы одновременный запрос не создал игроку вторую игру. Снимается при создании игры или ошибке записи
+    def reserve(self, players):
+        self.reserved.update(players)
+
+    def unreserve(self, players):
+        self.reserved.difference_update(players)
+
+    async def game_started(self, game_id: int, player1_id: int, player2_id: int):
+        self.busy[player1_id] = game_id
+        self.busy[player2_id] = game_id
+        self.unreserve([player1_id, player2_id])
+        await self.manager.publish({"kind": "player_busy", "game_id": game_id, "players": [player1_id, player2_id]})
+
+    #Пачка созданных игр: [(id игры, id игрока 1, id игрока 2)]. В шину - несколько событий на всю пачку
+    #(сообщение NOTIFY ограничено 8000 байт)
+    async def games_started(self, games):
+        for game_id, player1_id, player2_id in games:
+            self.busy[player1_id] = game_id
+            self.busy[player2_id] = game_id
+            self.unreserve([player1_id, player2_id])
+        for start in range(0, len(games), 200):
+            await self.manager.publish({"kind": "players_busy", "games": games[start:start + 200]})
+
+    async def game_ended(self, game_id: int, player1_id: int, player2_id: int):
+        self.release(game_id, [player1_id, player2_id])
+        await self.manager.publish({"kind": "player_free", "game_id": game_id, "players": [player1_id, player2_id]})
+
+    #Игрок свободен, только если он не попал уже в другую игру
+    def release(self, game_id: int, players):
+        for player_id in players:
+            if self.busy.get(player_id) == game_id:
+                del self.busy[player_id]
+
+    async def on_busy(self, event: dict):
+        for player_id in event["players"]:
+            self.busy[player_id] = event["game_id"]
+
+    async def on_busy_many(self, event: dict):
+        for game_id, player1_id, player2_id in event["games"]:
+            self.busy[player1_id] = game_id
+            self.busy[player2_id] = game_id
+
+    async def on_free(self, event: dict):
+        self.release(event["game_id"], event["players"])
+
+#Очередь поиска соперника. Первые два свободных игрока в очереди получают игру
+#create_game(player1_id, player2_id) - создание игры, возвращает id игры
+class Matchmaker:
+    def __init__(self, presence: Presence, create_game):
+        self.presence = presence
+        self.create_game = create_game
+        #id игрока -> сокет лобби, в порядке постановки в очередь
+        self.queue: OrderedDict[int, WebSocket] = OrderedDict()
+        self.lock = asyncio.Lock()
+
+    #Постановка в очередь. Если соперник уже ждет, создаем игру и сообщаем обоим
+    async def join(self, player_id: int, websocket: WebSocket):
+        async with self.lock:
+            if player_id in self.queue:
+                return
+            opponent = None
+            while self.queue:
+                opponent_id, opponent_socket = self.queue.popitem(last=False)
+                if not self.presence.is_busy(opponent_id):
+                    opponent = (opponent_id, opponent_socket)
+                    break
+            if opponent is None:
+                self.queue[player_id] = websocket
+                await websocket.send_text(encode_message({"type": "queued", "position": len(self.queue)}))
+                return
+            opponent_id, opponent_socket = opponent
+            game_id = await self.create_game(opponent_id, player_id)
+
+        for socket, other in ((opponent_socket, player_id), (websocket, opponent_id)):
+            try:
+                await socket.send_text(encode_message({"type": "match_found", "game_id": game_id, "opponent": other}))
+            except Exception:
+                pass
+
+    def leave(self, player_id: int, websocket: WebSocket = None):
+        if websocket is None or self.queue.get(player_id) is websocket:
+            self.queue.pop(player_id, None)
@@ -1,21 +1,56 @@
-from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.future import select
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, update, insert
+from sqlalchemy.engine import make_url
 from pydantic import BaseModel
-from hashlib import sha256
+from contextlib import asynccontextmanager
+from collections import Counter
+import asyncio
 import random
 import json
 import datetime
-
-from config_db import DB_HOST, DB_NAME, DB_USER, DB_PASSWORD
-from models import Base, Player, Game
-from game_logic import get_desks
+import time
+
+from config_db import (
+    DATABASE_URL,
+    GAME_FLUSH_INTERVAL, GAME_SNAPSHOT_EVERY, BOARD_POOL_SIZE, BOARD_STRATEGY,
+    GAME_EVENTS_BUFFER, BACKPLANE, SEND_QUEUE_SIZE, SLOW_CLIENT_POLICY,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    SESSION_SECRET, SESSION_TTL, LOGIN_CACHE_SIZE, LOGIN_CACHE_TTL,
+    REAPER_INTERVAL, GAME_TURN_TIMEOUT, GAME_ABANDON_TIMEOUT, GAME_EVICT_AFTER,
+    SPECTATOR_DELAY, SPECTATOR_QUEUE_SIZE, PAGE_SIZE, PAGE_MAX_SIZE, GAMES_BULK_MAX, WS_RATE, WS_BURST, WS_MAX_DROPPED,
+    GAME_ARCHIVE_AFTER_DAYS, GAME_ARCHIVE_INTERVAL, GAME_ARCHIVE_BATCH
+)
+from models import Base, Player, Game, Move, PlayerStats, GameArchive
 from connection_manager import ConnectionManager
-
-#Подключение к БД и создание сессии
-database_url = f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
-engine = create_async_engine(database_url)
+from backplane import LocalBackplane, PostgresBackplane
+from game_state import GameStateStore
+from board_pool import BoardPool
+from encoding import encode_message, Snapshot
+from game_logic import pack_desk, load_desk
+from lobby import Presence, Matchmaker
+from reaper import GameReaper
+from archive import GameArchiver, unpack_moves
+from spectators import Spectators
+from messages import parse_game_message, TokenBucket, MoveMessage, StartGameMessage, GameOverMessage
+from stats import stats_info, daily_stats
+from db_pool import MeteredPool, pool_metrics
+from auth import hash_password_async, verify_password_async, issue_token, verify_token, LoginCache
+import metrics
+from metrics import Gauge, WS_MESSAGE_SECONDS, WS_REJECTED, ERRORS, HTTPMetricsMiddleware, instrument_engine, span
+
+#Подключение к БД и создание сессии. Сессии короткие (на запрос или операцию), соединение возвращается в пул сразу
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=MeteredPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
 ASession = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 #Функция получения асинхронной сессии
@@ -32,7 +67,79 @@ class Players_Game(BaseModel):
     player1: int
     player2: int
 
-app = FastAPI()
+class Players_Games(BaseModel):
+    games: list[Players_Game]
+
+#Состояния активных игр в памяти процесса
+games_state = GameStateStore(ASession, GAME_FLUSH_INTERVAL, GAME_SNAPSHOT_EVERY, GAME_EVENTS_BUFFER)
+
+#Пул заранее созданных досок для новых игр
+boards_pool = BoardPool(BOARD_POOL_SIZE, BOARD_STRATEGY)
+
+#Менеджер вебсокетов. Шина событий между воркерами выбирается в конфиге (local - один воркер)
+if BACKPLANE == 'postgres':
+    backplane = PostgresBackplane(make_url(DATABASE_URL).set(drivername='postgresql').render_as_string(hide_password=False))
+else:
+    backplane = LocalBackplane()
+manager = ConnectionManager(backplane, max_queue=SEND_QUEUE_SIZE, slow_client_policy=SLOW_CLIENT_POLICY)
+
+#Игра этого процесса стала общей с другим воркером: записываем незаписанные ходы под lock игры,
+#чтобы следующие ходы шли уже через блокировку строки в БД
+async def flush_shared(game_id: int):
+    game = games_state.games.get(game_id)
+    if game is not None:
+        async with game.lock:
+            await games_state.flush([game_id])
+
+manager.on_shared = flush_shared
+games_state.in_use = lambda game_id: game_id in manager.active_connections
+
+#Кеш логинов игроков
+login_cache = LoginCache(LOGIN_CACHE_SIZE, LOGIN_CACHE_TTL)
+
+#Занятые игроки и очередь поиска соперника
+presence = Presence(manager)
+matchmaker = Matchmaker(presence, lambda player1, player2: create_game(player1, player2))
+
+#Зрители игр
+spectators = Spectators(manager, games_state, SPECTATOR_DELAY, SPECTATOR_QUEUE_SIZE)
+
+#Завершение брошенных игр и освобождение памяти
+reaper = GameReaper(manager, presence, games_state, lambda game_id, **kwargs: finish_game(game_id, **kwargs),
+                    REAPER_INTERVAL, GAME_TURN_TIMEOUT, GAME_ABANDON_TIMEOUT, GAME_EVICT_AFTER)
+
+#Перенос старых закончившихся игр в архив
+archiver = GameArchiver(ASession, GAME_ARCHIVE_AFTER_DAYS, GAME_ARCHIVE_INTERVAL, GAME_ARCHIVE_BATCH)
+
+#Фоновые задачи: запись состояний игр в БД, заполнение пула досок, шина событий между воркерами, завершение брошенных игр,
+#архив закончившихся игр. При остановке приложения записываем все несохраненные ходы
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await presence.load(ASession)
+    await manager.start()
+    tasks = [asyncio.create_task(boards_pool.run()), asyncio.create_task(manager.run()), asyncio.create_task(reaper.run()),
+             asyncio.create_task(archiver.run())]
+    if GAME_FLUSH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(games_state.run()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await games_state.flush()
+    await manager.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+#Метрики: время HTTP-запросов, запросов к БД, текущее количество игр, сокетов и состояние пула соединений
+app.add_middleware(HTTPMetricsMiddleware)
+instrument_engine(engine.sync_engine)
+Gauge("active_games", "Games loaded in this worker", lambda: len(games_state.games))
+Gauge("active_sockets", "Game WebSockets connected to this worker",
+      lambda: sum(len(sockets) for sockets in manager.active_connections.values()))
+Gauge("spectators", "Spectator WebSockets connected to this worker", spectators.viewer_count)
+Gauge("lobby_queue", "Players waiting for an opponent", lambda: len(matchmaker.queue))
+Gauge("board_pool_size", "Ready boards in the pool", lambda: len(boards_pool.boards))
+for key in pool_metrics(engine.pool):
+    Gauge(f"db_pool_{key}", f"DB connection pool {key}", lambda key=key: pool_metrics(engine.pool)[key])
 
 #Регистрация пользователя. Проверка уникального логина. Проверка ненулевых значений.
 @app.post("/players/register")
@@ -51,7 +158,8 @@ async def register(player_info: PlayerLoginPassword, db: AsyncSession = Depends(
         return {'status': "false",
                 'message:': "Пользователь с таким именем уже существует."}
     
-    hash_password = sha256(player_info.password.encode('utf-8')).hexdigest()
+    #Медленный хеш (scrypt) считается в отдельном потоке
+    hash_password = await hash_password_async(player_info.password)
 
     new_player = Player(login=player_info.login, password=hash_password)
     db.add(new_player)
@@ -60,7 +168,8 @@ async def register(player_info: PlayerLoginPassword, db: AsyncSession = Depends(
     return {'status': "true",
             'message:': "Успешная регистрация."}
 
-#Авторизация пользователя. Поиск пользователя в БД с переданным логином и паролем.
+#Авторизация пользователя. Поиск пользователя в БД по логину и проверка пароля.
+#При успехе выдается подписанный токен сессии для вебсокетов игры и лобби
 @app.post("/players/login")
 async def login(player_info: PlayerLoginPassword, db: AsyncSession = Depends(get_db)):
 
@@ -69,305 +178,517 @@ async def login(player_info: PlayerLoginPassword, db: AsyncSession = Depends(get
         return {'status': "false",         
                 'message:': "Поля не должны быть пустыми."}
 
-    hash_password = sha256(player_info.password.encode('utf-8')).hexdigest()
-
-    request = select(Player).where(Player.login == player_info.login,
-                                Player.password == hash_password)
+    request = select(Player.id, Player.password).where(Player.login == player_info.login)
     result = await db.execute(request)
-
-    if(result.scalar_one_or_none()):
-        return {'status': "true",
-            'message:': "Успешная авторизация."}
+    player = result.one_or_none()
+
+    if player:
+        ok, rehash = await verify_password_async(player_info.password, player.password)
+        if ok:
+            #Старый хеш (sha256) заменяем на scrypt
+            if rehash:
+                hash_password = await hash_password_async(player_info.password)
+                await db.execute(update(Player).where(Player.id == player.id).values(password=hash_password))
+                await db.commit()
+            login_cache.put(player.id, player_info.login)
+            return {'status': "true",
+                'message:': "Успешная авторизация.",
+                'player_id': player.id,
+                'token': issue_token(player.id, SESSION_SECRET, SESSION_TTL)}
     
     return {'status': "false",
             'message:': "Некорректные данные."}
 
 
 #Поучение игроков, которые не привязаны к активным играм.
+#Занятые игроки берутся из памяти (presence). Постранично: after - id последнего игрока предыдущей страницы,
+#limit - размер страницы (по умолчанию PAGE_SIZE). Если страница полная, в заголовке X-Next-After - after следующей страницы
 @app.get("/players")
-async def get_players(db: AsyncSession = Depends(get_db)):
-    #Нахождение игроков в активных играх
-    request = select(Game.player1_id).where(Game.date_ended.is_(None)).union(
-        select(Game.player2_id).where(Game.date_ended.is_(None))
+async def get_players(response: Response, after: int = 0, limit: int = Query(PAGE_SIZE, ge=1, le=PAGE_MAX_SIZE),
+                      db: AsyncSession = Depends(get_db)):
+    players_free = []
+    while len(players_free) < limit:
+        request = select(Player.id, Player.login).where(Player.id > after).order_by(Player.id).limit(limit)
+        result = await db.execute(request)
+        rows = result.all()
+        for player_id, player_login in rows:
+            after = player_id
+            login_cache.put(player_id, player_login)
+            if not presence.is_busy(player_id):
+                players_free.append({
+                    "id": player_id,
+                    "login": player_login
+                })
+                if len(players_free) == limit:
+                    break
+        if len(rows) < limit:
+            break
+
+    if len(players_free) == limit:
+        response.headers["X-Next-After"] = str(after)
+    return players_free
+
+#Создание игры: доски из пула, случайный первый ход. Игроки отмечаются занятыми.
+#Если запись не удалась, резерв игроков (check_pairings) снимается
+async def create_game(player1: int, player2: int):
+    game_desk = pack_desk(boards_pool.take())
+    new_game = Game(
+        desk_data=game_desk,
+        initial_desk_data=game_desk,
+        player1_id=player1,
+        player2_id=player2,
+        current_turn = random.choice([player1, player2]) #Случайно выбираем, кто ходит первым
     )
-    
-    players_in_game = await db.execute(request)
-    players_in_game = [row[0] for row in players_in_game.fetchall()]
-
-    #Запрос всех игроков, которые не привязаны к активным играм
-    request = select(Player).where(~Player.id.in_(players_in_game))
-    result = await db.execute(request)
-    players_free = result.scalars().all()
-
-    return [
-        {
-            "id": player.id,
-            "login": player.login
-        }
-        for player in players_free
-    ]
+    try:
+        async with ASession() as db:
+            db.add(new_game)
+            await db.commit()
+    except Exception:
+        presence.unreserve([player1, player2])
+        raise
+    await presence.game_started(new_game.id, player1, player2)
+    return new_game.id
+
+#Проверка пар игроков одним запросом к БД: игроки существуют, свободны и не повторяются.
+#Свободные игроки сразу резервируются (presence.reserve) до создания игр.
+#Возвращает текст ошибки и id проблемных игроков или (None, [])
+async def check_pairings(db: AsyncSession, pairings):
+    ids = []
+    for pair in pairings:
+        if pair.player1 == pair.player2:
+            return "Игрок не может играть сам с собой.", [pair.player1]
+        ids += [pair.player1, pair.player2]
+    repeated = sorted(player_id for player_id, count in Counter(ids).items() if count > 1)
+    if repeated:
+        return "Игрок указан в нескольких играх.", repeated
+
+    result = await db.execute(select(Player.id).where(Player.id.in_(ids)))
+    existing = set(result.scalars().all())
+    missing = [player_id for player_id in ids if player_id not in existing]
+    if missing:
+        return "Игроки не найдены.", missing
+
+    busy = [player_id for player_id in ids if presence.is_busy(player_id)]
+    if busy:
+        return "Игроки уже в игре.", busy
+    presence.reserve(ids)
+    return None, []
+
+#Создание пачки игр: доски из пула (недостающие - в потоке), все игры одним многострочным INSERT ... RETURNING.
+#Порядок строк RETURNING не гарантирован, id сопоставляются с парами по первому игроку (игрок есть только в одной паре).
+#Возвращает id игр в порядке пар. Если запись не удалась, резерв игроков снимается
+async def create_games(pairings):
+    try:
+        desks = await boards_pool.take_many(len(pairings))
+        rows = []
+        for pair, desk in zip(pairings, desks):
+            game_desk = pack_desk(desk)
+            rows.append({
+                "desk_data": game_desk,
+                "initial_desk_data": game_desk,
+                "player1_id": pair.player1,
+                "player2_id": pair.player2,
+                "current_turn": random.choice([pair.player1, pair.player2])
+            })
+        async with ASession() as db:
+            result = await db.execute(insert(Game).values(rows).returning(Game.id, Game.player1_id))
+            created = {player1_id: game_id for game_id, player1_id in result.all()}
+            await db.commit()
+    except Exception:
+        presence.unreserve([player_id for pair in pairings for player_id in (pair.player1, pair.player2)])
+        raise
+    game_ids = [created[pair.player1] for pair in pairings]
+    await presence.games_started([
+        [game_id, pair.player1, pair.player2] for game_id, pair in zip(game_ids, pairings)
+    ])
+    return game_ids
 
 #Получаем id двух игроков, создаем игровую доску для каждого игрока + кто ходит первым
-#Создаем игру и пишем в БД
+#Создаем игру и пишем в БД. Доски берутся из заранее заполненного пула
 @app.post("/games/create")
 async def game_create(players : Players_Game, db: AsyncSession = Depends(get_db)):
 
-    game_desk = json.dumps(get_desks())
-    new_game = Game(
-        desk=game_desk,
-        player1_id=players.player1,
-        player2_id=players.player2,
-        current_turn = random.choice([players.player1, players.player2]) #Случайно выбираем, кто ходит первым
-    )
-    db.add(new_game)
-    await db.commit()
-    await db.refresh(new_game)
+    error, player_ids = await check_pairings(db, [players])
+    if error:
+        return {'status': "false",
+                'message:': error,
+                'players': player_ids}
+
+    game_id = await create_game(players.player1, players.player2)
+
+    return {'status': "true",
+            'message:': "Игра создана.",
+            'game_id': game_id}
+
+#Пакетное создание игр (раунд турнира): {"games": [{"player1": ..., "player2": ...}, ...]}.
+#Игроки проверяются одним запросом, игры создаются одним INSERT. Ошибка в любой паре - ни одна игра не создается
+@app.post("/games/create_bulk")
+async def games_create_bulk(pairings: Players_Games, db: AsyncSession = Depends(get_db)):
+
+    if not pairings.games or len(pairings.games) > GAMES_BULK_MAX:
+        return {'status': "false",
+                'message:': f"Количество игр должно быть от 1 до {GAMES_BULK_MAX}."}
+
+    error, player_ids = await check_pairings(db, pairings.games)
+    if error:
+        return {'status': "false",
+                'message:': error,
+                'players': player_ids}
+
+    game_ids = await create_games(pairings.games)
 
     return {'status': "true",
-            'message:': "Игра создана."}
+            'message:': "Игры созданы.",
+            'game_ids': game_ids}
+
+#Запрос активных игр: только нужные колонки, доски - по запросу include_desk
+def active_games_request(after: int, limit: int, include_desk: bool):
+    columns = [Game.id, Game.player1_id, Game.player2_id, Game.current_turn, Game.date_created]
+    if include_desk:
+        columns += [Game.desk_data, Game.desk]
+    request = select(*columns).where(Game.date_ended.is_(None), Game.id > after).order_by(Game.id)
+    if limit is not None:
+        request = request.limit(limit)
+    return request
+
+#Ход и доски игр, загруженных в память, берутся из состояния: строка в БД пишется отложенно
+def active_game_info(row, include_desk: bool):
+    state = games_state.games.get(row.id)
+    game = {
+        "id": row.id,
+        "player1": row.player1_id,
+        "player2": row.player2_id,
+        "turn": state.current_turn if state else row.current_turn,
+        "date_created": row.date_created.isoformat() if row.date_created else None
+    }
+    if include_desk:
+        game["desk"] = state.desk if state else load_desk(row.desk_data, row.desk)
+    return game
+
+#Потоковая выдача игр в NDJSON (одна игра на строку) через серверный курсор: память не зависит от количества игр
+async def stream_active_games(after: int, limit: int, include_desk: bool):
+    async with ASession() as db:
+        result = await db.stream(active_games_request(after, limit, include_desk))
+        async for rows in result.partitions(500):
+            yield "".join(encode_message(active_game_info(row, include_desk)) + "\n" for row in rows)
 
 #получить активные игры
+#Постранично: after - id последней игры предыдущей страницы, limit - размер страницы (по умолчанию PAGE_SIZE).
+#Если страница полная, в заголовке X-Next-After - after следующей страницы.
+#include_desk - добавить доски (с расположением кораблей), stream - потоковая выдача в NDJSON (без limit - все игры)
 @app.get("/games")
-async def get_games(db: AsyncSession = Depends(get_db)):
+async def get_games(response: Response, after: int = 0, limit: int = Query(None, ge=1, le=PAGE_MAX_SIZE),
+                    include_desk: bool = False, stream: bool = False, db: AsyncSession = Depends(get_db)):
 
-    request = select(Game).where(Game.date_ended.is_(None))
-    result = await db.execute(request)
+    if stream:
+        return StreamingResponse(stream_active_games(after, limit, include_desk), media_type="application/x-ndjson")
 
-    active_games = result.scalars().all()
+    limit = limit or PAGE_SIZE
+    result = await db.execute(active_games_request(after, limit, include_desk))
+    rows = result.all()
 
-    return [
-        {
-            "id": game.id,
-            "desk": json.loads(game.desk)
-        }
-        for game in active_games
-    ]
+    if len(rows) == limit:
+        response.headers["X-Next-After"] = str(rows[-1].id)
+    return [active_game_info(row, include_desk) for row in rows]
 
+#Статистика игрока: победы, поражения, доля побед, серии, средняя длина игры (ходы и секунды), игр в день.
+#Читается одна строка сводки player_stats по первичному ключу. days - добавить игры и победы по дням за последние days дней (1-366)
 @app.get("/players/{player_sid}/stats")
-async def get_player_stats(player_sid: int, db: AsyncSession = Depends(get_db)):
-
-    player = await db.execute(select(Player).where(Player.id == player_sid))
-    player = player.scalar_one_or_none()
-    if not player:
-        return {'status': "false",
-            'message:': "Игрок не найден."}
-
-    request = select(Game).where(and_(or_(Game.player1_id == player_sid, Game.player2_id == player_sid),Game.date_ended.isnot(None)))
+async def get_player_stats(player_sid: int, days: int = Query(None, ge=1, le=366), db: AsyncSession = Depends(get_db)):
+
+    stats = await db.get(PlayerStats, player_sid)
+    #Сводки нет у игроков без завершенных игр - проверяем, что игрок существует
+    if stats is None:
+        player = await db.execute(select(Player.id).where(Player.id == player_sid))
+        if player.scalar_one_or_none() is None:
+            return {'status': "false",
+                'message:': "Игрок не найден."}
+
+    info = stats_info(player_sid, stats)
+    if days is not None:
+        since = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=days - 1)
+        info["daily"] = await daily_stats(db, player_sid, since)
+    return info
+
+#Журнал ходов игры для повтора и анализа
+@app.get("/games/{game_sid}/moves")
+async def get_game_moves(game_sid: int, db: AsyncSession = Depends(get_db)):
+
+    request = select(Move).where(Move.game_id == game_sid).order_by(Move.seq)
     result = await db.execute(request)
+    moves = result.scalars().all()
 
-    total_games = result.scalars().all()
+    #Ходов нет в журнале - игра могла быть перенесена в архив
+    if not moves:
+        request = select(GameArchive.player1_id, GameArchive.player2_id, GameArchive.moves_data).where(GameArchive.id == game_sid)
+        archived = (await db.execute(request)).first()
+        if archived is not None and archived.moves_data is not None:
+            return unpack_moves(archived.moves_data, archived.player1_id, archived.player2_id)
 
     return [
         {
-            "date": game.date_ended.date(),
-            "winner": game.winner_id
+            "seq": move.seq,
+            "player": move.player_id,
+            "col": move.col,
+            "row": move.row,
+            "result": move.result
         }
-        for game in total_games
+        for move in moves
     ]
 
+#Показатели пула соединений БД
+@app.get("/db/pool")
+async def get_db_pool():
+    return pool_metrics(engine.pool)
+
+#Метрики процесса в формате Prometheus
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-#######################################################################################
 
-#Менеджер вебсокетов
-manager = ConnectionManager()
+#######################################################################################
 
+#Ходы игры нумеруются (seq в move_result и game_info). При переподключении клиент передает last_seq -
+#номер последнего полученного хода - и получает resume и только пропущенные move_result. Если их уже нет в буфере,
+#отправляется полный снимок game_info
 @app.websocket("/games/{game_sid}/play")
-async def game_ws(websocket: WebSocket, game_sid: int, db: AsyncSession = Depends(get_db), connected_player_id : int = None):
+async def game_ws(websocket: WebSocket, game_sid: int, token: str = None, binary: bool = False, last_seq: int = None):
 
-    #Проверка id игры
-    request = select(Game).where(Game.id == game_sid)   
-    game = await db.execute(request)
-    game = game.scalar_one_or_none()
+    #Игрок определяется по токену сессии, выданному при входе. Без действительного токена игра не загружается
+    connected_player_id = verify_token(token, SESSION_SECRET)
+    if connected_player_id is None:
+        await websocket.close(code=1002)
+        return
+
+    #Проверка id игры. Состояние игры берется из памяти, из БД загружается только при первом подключении
+    game = await games_state.get(game_sid)
 
     if not game:
         await websocket.close(code=1002)
         return
     
     #Проверка id игрока
-    if (connected_player_id != game.player1_id) and (connected_player_id != game.player2_id):
+    if not game.is_player(connected_player_id):
         await websocket.close(code=1002)
         return
 
-    request1 = select(Player).where(Player.id == game.player1_id)  
-    request2 = select(Player).where(Player.id == game.player2_id)  
-
-    player1 = await db.execute(request1)
-    player2 = await db.execute(request2)
-
-    player1 = player1.scalar_one_or_none()
-    player2 = player2.scalar_one_or_none()
+    #Логины игроков запоминаются в игре, берутся из кеша логинов, в БД - только отсутствующие в кеше
+    if game.logins is None:
+        logins = await login_cache.logins(ASession, [game.player1_id, game.player2_id])
+        game.logins = (logins[game.player1_id], logins[game.player2_id])
 
     # Подключаем WebSocket
-    await manager.connect(websocket, game.id)
+    await manager.connect(websocket, game.game_id)
     
     try:
-        #Отправляем информацию об игре
-        initial_data = {
-            "type": "game_info",
-            "player1": player1.login,
-            "player2": player2.login,
-            "turn": game.current_turn
-        }
-        #Получение досок игроков
-        player1_board, player2_board = await process_game_data(game.id, db)
-
-        #передаю обе доски, чтобы игроки могли видеть попадания по доске врага
-        initial_data["board1"] = player1_board
-        initial_data["board2"] = player2_board
-
-        await manager.send_personal_message(json.dumps(initial_data), websocket)
+        #Игра открыта на другом воркере: ждем, пока он запишет свои ходы, и дочитываем их до снимка и первой команды
+        if game.game_id in manager.handoffs:
+            await manager.wait_handoff(game.game_id)
+            async with game.lock:
+                await games_state.refresh(game)
+
+        #Под lock игры: ход, который сейчас применяется, попадет либо в снимок (или пропущенные ходы), либо придет следом
+        async with game.lock:
+            missed = game.events_after(last_seq) if last_seq is not None else None
+            if missed is not None:
+                #Переподключение: только пропущенные ходы
+                await manager.send_personal_message(encode_message({
+                    "type": "resume",
+                    "seq": game.seq,
+                    "turn": game.current_turn,
+                    "missed": len(missed)
+                }), websocket)
+                for frame in missed:
+                    await manager.send_personal_message(frame, websocket)
+            else:
+                #Отправляем информацию об игре
+                #передаю обе доски, чтобы игроки могли видеть попадания по доске врага
+                #Закодированный снимок переиспользуется, пока состояние игры не изменилось.
+                #Клиенты с binary=true получают доски отдельным бинарным кадром
+                if game.snapshot is None or game.snapshot.version != game.version:
+                    initial_data = {
+                        "type": "game_info",
+                        "player1": game.logins[0],
+                        "player2": game.logins[1],
+                        "turn": game.current_turn,
+                        "seq": game.seq
+                    }
+                    game.snapshot = Snapshot(game.version, initial_data, game.desk)
+
+                for frame in game.snapshot.frames(binary):
+                    await manager.send_personal_message(frame, websocket)
+
+        #Соперник узнает, что игрок вернулся
+        if last_seq is not None:
+            await manager.broadcast(encode_message({
+                "type": "player_reconnect",
+                "player": connected_player_id
+            }), game.game_id, key=f"player_status:{connected_player_id}")
         
-        #Ожидаем сообщения от клиента
+        #Ожидаем сообщения от клиента. Частота ограничена: лишние сообщения отбрасываются до разбора,
+        #клиент получает одно сообщение об ошибке, а при продолжающемся потоке сокет закрывается
+        bucket = TokenBucket(WS_RATE, WS_BURST)
+        dropped = 0
         while True:
-            message = await websocket.receive_text()
-                     
-            try:
-                message = json.loads(message)
-            except json.JSONDecodeError:
-                await manager.send_personal_message(json.dumps({
+            data = await websocket.receive_text()
+            if not bucket.take():
+                WS_REJECTED.inc("rate_limit")
+                dropped += 1
+                if dropped == 1:
+                    await manager.send_personal_message(encode_message({
+                        "type": "error",
+                        "message": "Too many messages"
+                    }), websocket, key="error")
+                elif dropped > WS_MAX_DROPPED:
+                    await websocket.close(code=1008)
+                    break
+                continue
+            dropped = 0
+            start = time.perf_counter()
+
+            #Разбор и проверка схемы сообщения
+            message, error = parse_game_message(data)
+            if error:
+                WS_REJECTED.inc("schema")
+                await manager.send_personal_message(encode_message({
                     "type": "error",
-                    "message": "Wrong message format"
-                }), websocket)
+                    "message": error
+                }), websocket, key="error")
                 continue
+            WS_MESSAGE_SECONDS.observe(time.perf_counter() - start, "json_decode")
 
-            #Обработка сообщений  
-            #Каждый ход достаем доски из базы и обновляем + изменяем ход    
-            if message["type"] == "move":
-                await move(websocket, game.id, connected_player_id, message, db)
-                
-            elif message["type"] == "start_game":
-                await start_game(websocket, game.id)
-                
-            elif message["type"] == "game_over":
-                await end_game(websocket, game.id, db)
+            #Обработка сообщений по типу
+            #Ход применяется к состоянию игры в памяти, в БД изменения пишутся отложенно
+            #Время обработки учитывается по типу сообщения
+            with span("ws " + message.type, game_id=game.game_id, player_id=connected_player_id):
+                await MESSAGE_HANDLERS[message.type](websocket, game.game_id, connected_player_id, message)
+            WS_MESSAGE_SECONDS.observe(time.perf_counter() - start, message.type)
 
     except WebSocketDisconnect:
         #Отправляем уведомление об отключении игрока
-        manager.disconnect(websocket, game.id)
+        manager.disconnect(websocket, game.game_id)
         disconnect_message = {
             "type": "player_disconnect",
+            "player": connected_player_id,
             "message": "Player disconnected"
         }
-        await manager.broadcast(json.dumps(disconnect_message), game.id)
+        await manager.broadcast(encode_message(disconnect_message), game.game_id, key=f"player_status:{connected_player_id}")
 
     except Exception as e:
+        ERRORS.inc("game_ws")
         print(f"Websocket error: {e}")
     finally:
-        manager.disconnect(websocket, game.id)
-
-#Функция для получения данных игровых досок из БД
-async def get_game_desk(game_id: int, db: AsyncSession):
- 
-    request = select(Game).where(Game.id == game_id)   
-    result = await db.execute(request)
-    game = result.scalar_one_or_none()   
-
-    desk_data = json.loads(game.desk)
-    return desk_data
-            
-
-#Разделяем доски игроков
-async def process_game_data(game_id: int, db: AsyncSession):
+        manager.disconnect(websocket, game.game_id)
+        #Оба игрока отключились - записываем игру и освобождаем память
+        if game.game_id not in manager.active_connections:
+            await games_state.evict(game.game_id)
+
+#Просмотр игры зрителем (только чтение). Зритель получает снимок spectate_info с публичными досками
+#(0 - клетка не обстреляна, 1 - промах, 2 - попадание, 3 - уничтоженный корабль, -1 - выстрел с неизвестным результатом),
+#затем события shot и spectate_end. Лента отстает от игры на SPECTATOR_DELAY секунд
+@app.websocket("/games/{game_sid}/watch")
+async def watch_ws(websocket: WebSocket, game_sid: int):
+    if not await spectators.watch(websocket, game_sid):
+        await websocket.close(code=1002)
+        return
 
-    game_desk = await get_game_desk(game_id, db)
-       
-    player1_data = game_desk["player1"]
-    player2_data = game_desk["player2"]
-            
-    return player1_data, player2_data
+    try:
+        #Сообщения зрителя не обрабатываются, чтение нужно только для обнаружения отключения
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        ERRORS.inc("watch_ws")
+        print(f"Spectator websocket error: {e}")
+    finally:
+        spectators.leave(websocket)
 
-async def move(websocket: WebSocket, game_id: int, player_id: int, message: dict, db: AsyncSession):
+async def move(websocket: WebSocket, game_id: int, player_id: int, message: MoveMessage):
     #в сообщении получаем координаты, проверяем попадание, проверяем завершение игры, меняем ход   
-    #получаем актуальную информацию об игре
-    request = select(Game).where(Game.id == game_id)   
-    result = await db.execute(request)
-    game = result.scalar_one_or_none()  
-
-    #проверка хода. Если не ход игрока, отправляем сообщение и выходим
-    if (player_id != game.current_turn):
-        message = {
-            "type": "move_false",
-            "message": "Not your turn."
-        }
-        await manager.send_personal_message(json.dumps(message), websocket) 
+    #получаем актуальную информацию об игре из памяти
+    game = await games_state.get(game_id)
+    if not game:
         return
 
-    #Получить доски
-    player1_board, player2_board = await process_game_data(game.id, db)
-
     #координаты выстрела
-    X = message["col"]
-    Y = message["row"]
-    #По какой доске стреляем
-    cur_board = [[]]
-    p1 = False
-    if(player_id == game.player1_id): cur_board = player2_board
-    else: 
-        cur_board = player1_board
-        p1 = True
-
-    #Получаем значение в месте попадания
-    hit_place = cur_board[X][Y]
-
-    #Отмечаем выстрел
-    cur_board[X][Y] = -1
-
-    #проверка попадания
-    is_hit = False
-    if(hit_place >0 ): is_hit = True
-    #проверка уничтожения корабля и окончания игры
-    kill = False
-    game_over = False
-    #Если на доске больше нет клеток с индексом корабля, то он уничтожен
-    if(is_hit):
-        counthit = 0
-        countships = 0
-        for row in cur_board:
-            for index in row:
-                if index == hit_place:
-                    counthit +=1
-                if index > 0:
-                    countships +=1
-        if(counthit == 0): kill = True
-        if(countships == 0): game_over = True       
-    #Если промах, то происходит смена хода. Если игра закончена, то ход не меняется (Получаем победителя из game.current_turn)
-    else:
-        if not(game_over):
-            if(game.current_turn == game.player1_id): game.current_turn = game.player2_id
-            else: game.current_turn = game.player1_id
-
-    #Сохранение изменений в базу данных
-    if(p1):
-        desk = {
-            "player1": cur_board,
-            "player2": player2_board
-        }
-    else:
-        desk = {
-            "player1": player1_board,
-            "player2": cur_board
+    X = message.col
+    Y = message.row
+
+    #Ходы одной игры применяются строго по очереди. Если сокеты игры подключены к разным воркерам,
+    #ход применяется под блокировкой строки Game в БД и записывается сразу
+    async with game.lock:
+        #Пока ход ждал lock, игру могли завершить
+        if game.finished:
+            return
+
+        #Повторный выстрел в ту же клетку отклоняется до обращения к БД
+        if game.already_shot(player_id, X, Y):
+            WS_REJECTED.inc("duplicate_shot")
+            await manager.send_personal_message(encode_message({
+                "type": "move_false",
+                "message": "Cell already shot."
+            }), websocket, key="move_false")
+            return
+
+        #Игра уже выиграна: ходы не принимаются
+        if game.winner is not None:
+            await manager.send_personal_message(encode_message({
+                "type": "move_false",
+                "message": "Game is over."
+            }), websocket, key="move_false")
+            return
+
+        if manager.is_shared(game_id):
+            result = await games_state.apply_locked(game, lambda: game.move(player_id, X, Y))
+        else:
+            result = game.move(player_id, X, Y)
+            #Без интервала отложенной записи сохраняем ход сразу
+            if result is not None and GAME_FLUSH_INTERVAL <= 0:
+                await games_state.flush([game_id])
+
+        #проверка хода. Если не ход игрока, отправляем сообщение и выходим
+        if result is None:
+            message = {
+                "type": "move_false",
+                "message": "Not your turn."
+            }
+            await manager.send_personal_message(encode_message(message), websocket, key="move_false")
+            return
+
+        #Посылаем сообщение. seq - номер хода, по нему клиент переподключается без полного снимка
+        message = {
+            "type": "move_result",
+            "seq": game.seq,
+            "hit": result["hit"],
+            "kill": result["kill"],
+            "game_over": result["game_over"]
         }
-
-    game.desk = json.dumps(desk)
-
-    await db.commit()
-    await db.refresh(game)
-
-    #Посылаем сообщение
-    message = {
-        "type": "move_result",
-        "hit": is_hit,
-        "kill": kill,
-        "game_over": game_over
-    }
-
-    await manager.broadcast(json.dumps(message), game_id)
+        #При уничтожении корабля сообщаем его клетки и клетки вокруг него
+        if result["kill"]:
+            message["ship_cells"] = result["ship_cells"]
+            message["ring_cells"] = result["ring_cells"]
+
+        message = encode_message(message)
+        game.record_event(message)
+        await manager.broadcast(message, game_id)
+
+        #Зрителям - отдельное событие без положения кораблей, только если у игры есть зрители
+        spectate = None
+        if spectators.watched(game_id):
+            spectate = spectators.shot_event(game, player_id, X, Y, result)
+            spectators.push(game_id, spectate)
+
+    #Зрителям на других воркерах событие публикуется после освобождения lock игры
+    if spectate is not None:
+        await spectators.publish_remote(game_id, spectate)
     return
 
 
-async def start_game(websocket: WebSocket, game_id: int):
-    #проверка двух подключений + бродкаст сообщения о начале
-    if len(manager.active_connections[game_id]) != 2:
+async def start_game(websocket: WebSocket, game_id: int, player_id: int, message: StartGameMessage):
+    #проверка двух подключений (на всех воркерах) + бродкаст сообщения о начале
+    if manager.connection_count(game_id) != 2:
         message = {
             "type": "start_game_false",
             "message": "Wait for second player!"
@@ -377,29 +698,98 @@ async def start_game(websocket: WebSocket, game_id: int):
             "type": "start_game_true",
             "message": "Game start!"
         }
-    await manager.broadcast(json.dumps(message), game_id)
+    await manager.broadcast(encode_message(message), game_id, key="start_game")
     return
 
-async def end_game(websocket: WebSocket, game_id: int, db: AsyncSession):
-    #заканчиваем игру. Записываем в базу дату окончания и победителя
-
-    #получаем актуальную информацию об игре
-    request = select(Game).where(Game.id == game_id)   
-    result = await db.execute(request)
-    game = result.scalar_one_or_none() 
-
-    game.date_ended = datetime.datetime.utcnow()
-    game.winner_id = game.current_turn
+async def end_game(websocket: WebSocket, game_id: int, player_id: int, message: GameOverMessage):
+    #заканчиваем игру, только если состояние игры уже знает победителя (весь флот соперника уничтожен)
+    game = await games_state.get(game_id)
+    if not game:
+        return
+    if game.winner is None:
+        await manager.send_personal_message(encode_message({
+            "type": "end_game_false",
+            "message": "Game is not over."
+        }), websocket, key="end_game_false")
+        return
+    await finish_game(game_id)
+
+#Завершение игры по сообщению игрока или по таймауту (reaper). Записываем в базу доски, дату окончания и победителя.
+#Победитель берется из состояния игры, дочитанного из БД при записи. Без победителя игра завершается только как forfeit (reaper):
+#игрок, за которым ход, проигрывает; если ходов еще не было, игра отменяется без победителя.
+#reason - причина завершения для клиентов
+async def finish_game(game_id: int, forfeit: bool = False, reason: str = None):
+    game = await games_state.get(game_id)
+    if not game:
+        return
 
-    await db.commit()
+    async with game.lock:
+        if game.finished or (game.winner is None and not forfeit):
+            return
+        if not await games_state.finish(game, datetime.datetime.utcnow(), forfeit):
+            return
+        winner_id = game.winner
+    await presence.game_ended(game_id, game.player1_id, game.player2_id)
 
     message = {
             "type": "end_game_true",
-            "message": f"Game over! Winner: {game.winner_id}"          
+            "message": f"Game over! Winner: {winner_id}",
+            "winner": winner_id
         }
+    if reason:
+        message["reason"] = reason
     
-    await manager.broadcast(json.dumps(message), game_id)
+    await manager.broadcast(encode_message(message), game_id)
+    if spectators.watched(game_id):
+        await spectators.game_ended(game_id, winner_id)
 
     return
 
+#Обработчики сообщений сокета игры по типу: handler(websocket, game_id, player_id, message)
+MESSAGE_HANDLERS = {
+    "move": move,
+    "start_game": start_game,
+    "game_over": end_game
+}
+
+#Лобби: поиск соперника. Клиент отправляет {"type": "find_game"} или {"type": "cancel"},
+#при найденной паре оба игрока получают {"type": "match_found", "game_id": ...}
+@app.websocket("/lobby")
+async def lobby_ws(websocket: WebSocket, token: str = None):
+    connected_player_id = verify_token(token, SESSION_SECRET)
+    if connected_player_id is None:
+        await websocket.close(code=1002)
+        return
+
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                message = json.loads(message)
+            except json.JSONDecodeError:
+                await websocket.send_text(encode_message({
+                    "type": "error",
+                    "message": "Wrong message format"
+                }))
+                continue
+
+            if message.get("type") == "find_game":
+                if presence.is_busy(connected_player_id):
+                    await websocket.send_text(encode_message({
+                        "type": "find_game_false",
+                        "message": "Player is already in game."
+                    }))
+                else:
+                    await matchmaker.join(connected_player_id, websocket)
+
+            elif message.get("type") == "cancel":
+                matchmaker.leave(connected_player_id, websocket)
 
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        ERRORS.inc("lobby_ws")
+        print(f"Lobby websocket error: {e}")
+    finally:
+        matchmaker.leave(connected_player_id, websocket)
@@ -0,0 +1,53 @@
+import time
+from typing import Annotated, Literal, Union
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+#Входящие сообщения сокета игры. Схема компилируется один раз (pydantic-core), JSON разбирается и проверяется
+#за один проход: тип сообщения выбирается по полю type, координаты - целые числа в пределах поля
+Coordinate = Annotated[int, Field(ge=0, le=9, strict=True)]
+
+class MoveMessage(BaseModel):
+    type: Literal["move"]
+    col: Coordinate
+    row: Coordinate
+
+class StartGameMessage(BaseModel):
+    type: Literal["start_game"]
+
+class GameOverMessage(BaseModel):
+    type: Literal["game_over"]
+
+GameMessage = TypeAdapter(
+    Annotated[Union[MoveMessage, StartGameMessage, GameOverMessage], Field(discriminator="type")]
+)
+
+#Разбор кадра. Возвращает (сообщение, None) или (None, текст ошибки для клиента)
+def parse_game_message(data):
+    try:
+        return GameMessage.validate_json(data), None
+    except ValidationError as e:
+        error = e.errors()[0]["type"]
+        if error == "json_invalid" or error == "dict_type":
+            return None, "Wrong message format"
+        if error == "union_tag_invalid" or error == "union_tag_not_found":
+            return None, "Unknown message type"
+        return None, "Wrong message fields"
+
+#Ограничение частоты сообщений сокета (token bucket): rate сообщений в секунду, не больше burst подряд
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    #Забрать один токен. False - сообщение нужно отбросить
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
@@ -0,0 +1,148 @@
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+#Метрики процесса в текстовом формате Prometheus (/metrics) и необязательные хуки трассировки.
+#Наблюдение - сложение в словаре без блокировок (один цикл событий), поэтому метрики можно держать включенными
+
+#Границы корзин гистограмм времени (сек)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REGISTRY = []
+
+def label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{label_text(self.labels, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        #метки -> [счетчики корзин (последняя - +Inf), сумма, количество]
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{label_text(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{label_text(self.labels, labels)} {count}")
+        return lines
+
+#Значение считывается в момент выдачи метрик: read() возвращает число или словарь {значения меток: число}
+class Gauge:
+    def __init__(self, name: str, help: str, read, labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.read()
+        if isinstance(value, dict):
+            for labels, item in value.items():
+                lines.append(f"{self.name}{label_text(self.labels, labels)} {item}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+WS_MESSAGE_SECONDS = Histogram("ws_message_seconds", "WebSocket message handling time by message type", ("type",))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "DB query execution time by statement kind", ("statement",))
+BROADCAST_SECONDS = Histogram("broadcast_seconds", "Broadcast fan-out time to local sockets and the backplane")
+HTTP_REQUEST_SECONDS = Histogram("http_request_seconds", "HTTP request time by route", ("method", "route", "status"))
+ERRORS = Counter("errors_total", "Handled errors by place", ("where",))
+WS_REJECTED = Counter("ws_rejected_total", "Game WebSocket messages rejected before handling by reason", ("reason",))
+
+#Хуки трассировки: hook(name, attributes) возвращает контекстный менеджер спана.
+#Например, для OpenTelemetry: span_hooks.append(lambda name, attributes: tracer.start_as_current_span(name, attributes=attributes))
+span_hooks = []
+
+def span(name: str, **attributes):
+    if not span_hooks:
+        return nullcontext()
+    return span_hooks[0](name, attributes)
+
+#Время запросов к БД через события SQLAlchemy (engine - синхронный движок, для async - engine.sync_engine)
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, statement.lstrip().split(" ", 1)[0].upper())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        ERRORS.inc("db")
+
+#ASGI-обертка: время HTTP-запросов по шаблону маршрута (а не по пути с id) и коду ответа
+class HTTPMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            with span("http " + scope["method"], path=scope["path"]):
+                await self.app(scope, receive, send_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], route, status[0])
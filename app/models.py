@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, Integer, SmallInteger, String, DateTime, JSON, LargeBinary, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
@@ -24,15 +24,93 @@ class Game(Base):
     id = Column(Integer, primary_key=True)
     date_created = Column(DateTime, default=datetime.datetime.utcnow)
     date_ended = Column(DateTime, nullable=True)
-    desk = Column(JSON, nullable=False)
+    #Снимок досок на ходе snapshot_seq, упакованный game_logic.pack_desk. Следующие ходы хранятся в moves
+    desk_data = Column(LargeBinary, nullable=True)
+    #Начальные доски, записываются один раз при создании игры
+    initial_desk_data = Column(LargeBinary, nullable=True)
+    #Старый формат досок (JSON-строка в JSON). Заполнен у игр, созданных до перехода на упакованные доски (migrate_db.py)
+    desk = Column(JSON, nullable=True)
+    initial_desk = Column(JSON, nullable=True)
+    snapshot_seq = Column(Integer, nullable=False, default=0, server_default='0')
     player1_id = Column(Integer, ForeignKey('players.id'), nullable=False)
     player2_id = Column(Integer, ForeignKey('players.id'), nullable=False)
     winner_id = Column(Integer, ForeignKey('players.id'), nullable=True)
     current_turn = Column(Integer, nullable=False) 
+    #Версия строки: растет при каждой записи, используется для сравнения при обновлении
+    version = Column(Integer, nullable=False, default=0, server_default='0')
 
     player1_obj = relationship("Player", foreign_keys=[player1_id], back_populates="games_as_player1")
     player2_obj = relationship("Player", foreign_keys=[player2_id], back_populates="games_as_player2")
     winner_obj = relationship("Player", foreign_keys=[winner_id])
+
+    __table_args__ = (
+        #Частичный индекс активных игр: список игр, занятость игроков при старте. Закончившиеся игры в него не попадают
+        Index('ix_games_active', 'id', postgresql_where=date_ended.is_(None), sqlite_where=date_ended.is_(None)),
+        #Завершенные игры игрока по дате окончания (статистика по дням)
+        Index('ix_games_player1_ended', 'player1_id', 'date_ended'),
+        Index('ix_games_player2_ended', 'player2_id', 'date_ended'),
+    )
     
     def __repr__(self):
         return f"<Game(id={self.id}, created={self.date_created}, ended={self.date_ended})>"
+
+#Журнал ходов: одна строка на выстрел. Состояние игры = начальные доски (или снимок) + ходы по порядку seq
+#result: 0 - промах, 1 - попадание, 2 - корабль уничтожен
+class Move(Base):
+    __tablename__ = 'moves'
+
+    game_id = Column(Integer, ForeignKey('games.id'), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    player_id = Column(Integer, nullable=False)
+    row = Column(SmallInteger, nullable=False)
+    col = Column(SmallInteger, nullable=False)
+    result = Column(SmallInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<Move(game_id={self.game_id}, seq={self.seq}, result={self.result})>"
+
+#Сводная статистика игрока, обновляется при завершении каждой игры (stats.record_game).
+#current_streak: > 0 - серия побед, < 0 - серия поражений. Длина игр: ходы всей игры и секунды от создания до окончания
+class PlayerStats(Base):
+    __tablename__ = 'player_stats'
+
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    current_streak = Column(Integer, nullable=False, default=0)
+    longest_win_streak = Column(Integer, nullable=False, default=0)
+    longest_loss_streak = Column(Integer, nullable=False, default=0)
+    total_moves = Column(Integer, nullable=False, default=0)
+    total_seconds = Column(Integer, nullable=False, default=0)
+    first_game = Column(DateTime, nullable=True)
+    last_game = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<PlayerStats(player_id={self.player_id}, games={self.games}, wins={self.wins})>"
+
+#Архив закончившихся игр (app/archive.py): итоговые колонки без снимков досок. Начальные доски упакованы (pack_desk),
+#журнал ходов сжат (archive.pack_moves), строки moves архивной игры удаляются.
+#В Postgres таблица секционирована по месяцам date_ended, секции создает архиватор
+class GameArchive(Base):
+    __tablename__ = 'games_archive'
+
+    id = Column(Integer, primary_key=True)
+    date_ended = Column(DateTime, primary_key=True)
+    date_created = Column(DateTime, nullable=True)
+    player1_id = Column(Integer, ForeignKey('players.id'), nullable=False)
+    player2_id = Column(Integer, ForeignKey('players.id'), nullable=False)
+    winner_id = Column(Integer, ForeignKey('players.id'), nullable=True)
+    moves = Column(Integer, nullable=False, default=0)
+    initial_desk_data = Column(LargeBinary, nullable=True)
+    moves_data = Column(LargeBinary, nullable=True)
+
+    __table_args__ = (
+        #Архивные игры игрока по дате окончания (статистика по дням)
+        Index('ix_games_archive_player1_ended', 'player1_id', 'date_ended'),
+        Index('ix_games_archive_player2_ended', 'player2_id', 'date_ended'),
+        {'postgresql_partition_by': 'RANGE (date_ended)'},
+    )
+
+    def __repr__(self):
+        return f"<GameArchive(id={self.id}, ended={self.date_ended})>"
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from metrics import ERRORS
+
+#Жизненный цикл игр: фоновая задача завершает брошенные игры и освобождает память процесса.
+#Активность игры - подключения и сообщения игры на любом воркере (manager.activity).
+#turn_timeout - к игре подключен сокет этого процесса, но ходов нет дольше этого времени: игрок, за которым ход, проигрывает
+#abandon_timeout - к игре никто не подключен дольше этого времени: то же, а игра без ходов отменяется
+#evict_after - состояние игры без сокетов в этом процессе выгружается из памяти, сокеты закончившейся игры закрываются
+#end_game(game_id, forfeit, reason) - завершение игры тем же путем, что и по сообщению игрока
+class GameReaper:
+    def __init__(self, manager, presence, games_state, end_game, interval: float = 10,
+                 turn_timeout: float = 120, abandon_timeout: float = 3600, evict_after: float = 60, batch: int = 100):
+        self.manager = manager
+        self.presence = presence
+        self.games_state = games_state
+        self.end_game = end_game
+        self.interval = interval
+        self.turn_timeout = turn_timeout
+        self.abandon_timeout = abandon_timeout
+        self.evict_after = evict_after
+        #Сколько игр завершать за один проход
+        self.batch = batch
+
+    async def reap(self):
+        now = time.monotonic()
+        activity = self.manager.activity
+        active_games = set(self.presence.busy.values())
+        #Активные игры без сведений об активности (созданы до запуска процесса или на другом воркере): отсчет с этого момента
+        for game_id in active_games:
+            activity.setdefault(game_id, now)
+
+        ended = 0
+        for game_id, last in list(activity.items()):
+            idle = now - last
+            local = game_id in self.manager.active_connections
+            if game_id not in active_games:
+                #Игра закончилась: закрываем сокеты, которые клиенты не закрыли сами, и забываем игру
+                if idle > self.evict_after:
+                    if local:
+                        self.manager.close_game(game_id)
+                    else:
+                        activity.pop(game_id, None)
+                continue
+
+            #Игру с сокетами только на других воркерах обслуживают они
+            if not local and self.manager.is_shared(game_id):
+                continue
+            if ended < self.batch and idle > (self.turn_timeout if local else self.abandon_timeout):
+                ended += 1
+                await self.end_game(game_id, forfeit=True, reason="timeout" if local else "abandoned")
+
+        #Состояния игр без сокетов в этом процессе записываем и выгружаем
+        for game_id in list(self.games_state.games):
+            if game_id not in self.manager.active_connections and now - activity.get(game_id, 0) > self.evict_after:
+                await self.games_state.evict(game_id)
+
+        self.manager.prune()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                ERRORS.inc("reaper")
+                print(f"Game reaper error: {e}")
@@ -0,0 +1,244 @@
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+#Симулятор нужен только для офлайн-расчетов, numpy в зависимости сервера не входит
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("simulator.py requires numpy: pip install numpy") from e
+
+from game_logic import SHIPS, STRATEGIES, desk_create
+
+#Пакетная симуляция игр друг с другом по правилам move(): попадание - игрок стреляет снова, промах - ход переходит,
+#игра заканчивается, когда уничтожены все корабли соперника. Все игры пакета обрабатываются одновременно массивами numpy.
+#python simulator.py --games 100000 --policy1 hunt --policy2 density --workers 4
+
+#Длина корабля по индексу (1-10), как в desk_create
+SHIP_LENGTHS = np.array([0] + [length for length, count in SHIPS.items() for _ in range(count)], dtype=np.int64)
+#Клетки "шахматной" раскраски: корабль длиной от 2 всегда занимает хотя бы одну такую клетку
+PARITY = (np.add.outer(np.arange(10), np.arange(10)) % 2 == 0)
+
+#Сдвиг досок (n, 10, 10): результат в клетке (r, c) - значение клетки (r + dr, c + dc), за пределами поля False
+def shifted(a, dr, dc):
+    out = np.zeros_like(a)
+    out[:, max(-dr, 0):10 - max(dr, 0), max(-dc, 0):10 - max(dc, 0)] = \
+        a[:, max(dr, 0):10 - max(-dr, 0), max(dc, 0):10 - max(-dc, 0)]
+    return out
+
+ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+#Клетки и все соседние с ними клетки
+def dilate(a):
+    out = a.copy()
+    for dr, dc in ORTHOGONAL + DIAGONAL:
+        out |= shifted(a, dr, dc)
+    return out
+
+#Состояние пакета игр. Игрок p (0 - player1, 1 - player2) стреляет по доске соперника 1 - p.
+#Знания игрока p о доске соперника: shot - выстрелы, hit - попадания по еще не уничтоженным кораблям,
+#blocked - клетки, где корабля точно нет или уже стреляли (выстрелы и контуры уничтоженных кораблей),
+#remaining - количество неуничтоженных кораблей соперника по длине
+class Batch:
+    def __init__(self, desks, first):
+        n = len(desks)
+        self.ships = np.array([[desk["player1"], desk["player2"]] for desk in desks], dtype=np.int8).reshape(n, 2, 100)
+        self.hp = np.stack([(self.ships == index).sum(axis=2) for index in range(11)], axis=2)
+        self.hp[:, :, 0] = 0
+        self.alive = self.hp.sum(axis=2)
+        self.shot = np.zeros((n, 2, 100), dtype=bool)
+        self.hit = np.zeros((n, 2, 100), dtype=bool)
+        self.blocked = np.zeros((n, 2, 100), dtype=bool)
+        self.remaining = np.zeros((n, 2, 5), dtype=np.int64)
+        for length, count in SHIPS.items():
+            self.remaining[:, :, length] = count
+        self.first = np.asarray(first, dtype=np.int64)
+        self.turn = self.first.copy()
+        self.shots = np.zeros((n, 2), dtype=np.int64)
+        self.winner = np.full(n, -1, dtype=np.int64)
+
+    #Один выстрел во всех незаконченных играх. Возвращает False, когда все игры закончены
+    def step(self, policies, rng):
+        active = np.flatnonzero(self.winner < 0)
+        if not len(active):
+            return False
+        player = self.turn[active]
+        opponent = 1 - player
+        cells = np.empty(len(active), dtype=np.int64)
+        for index, policy in enumerate(policies):
+            mask = player == index
+            if mask.any():
+                cells[mask] = policy(self, active[mask], index, rng)
+
+        values = self.ships[active, opponent, cells]
+        self.shot[active, player, cells] = True
+        self.blocked[active, player, cells] = True
+        self.shots[active, player] += 1
+
+        hit = values > 0
+        games, shooter, target, ship, cell = active[hit], player[hit], opponent[hit], values[hit], cells[hit]
+        self.hit[games, shooter, cell] = True
+        self.hp[games, target, ship] -= 1
+        self.alive[games, target] -= 1
+
+        #Уничтоженный корабль: его клетки и контур становятся известны стрелявшему
+        kill = self.hp[games, target, ship] == 0
+        if kill.any():
+            games_k, shooter_k, target_k, ship_k = games[kill], shooter[kill], target[kill], ship[kill]
+            ship_cells = self.ships[games_k, target_k] == ship_k[:, None]
+            self.blocked[games_k, shooter_k] |= dilate(ship_cells.reshape(-1, 10, 10)).reshape(-1, 100)
+            self.hit[games_k, shooter_k] &= ~ship_cells
+            self.remaining[games_k, shooter_k, SHIP_LENGTHS[ship_k]] -= 1
+
+        over = self.alive[games, target] == 0
+        self.winner[games[over]] = shooter[over]
+        #Промах - ход переходит к сопернику
+        self.turn[active[~hit]] = opponent[~hit]
+        return True
+
+#Стратегии стрельбы: policy(batch, games, player, rng) -> индексы клеток (row * 10 + col) для игр games
+#Случайная клетка, по которой еще не стреляли
+def random_policy(batch, games, player, rng):
+    scores = rng.random((len(games), 100))
+    scores[batch.blocked[games, player]] = -1
+    return scores.argmax(axis=1)
+
+#Охота и добивание: клетки рядом с попаданиями (вдоль линии из двух попаданий - в первую очередь),
+#без попаданий - случайная клетка "шахматной" раскраски. По диагонали от попадания кораблей нет
+def hunt_target_policy(batch, games, player, rng):
+    hits = batch.hit[games, player].reshape(-1, 10, 10)
+    blocked = batch.blocked[games, player].reshape(-1, 10, 10)
+    scores = rng.random(hits.shape) * 0.1 + 0.5 * PARITY
+    for dr, dc in ORTHOGONAL:
+        near = shifted(hits, dr, dc)
+        scores += near
+        scores += 2 * (near & shifted(hits, 2 * dr, 2 * dc))
+    for dr, dc in DIAGONAL:
+        blocked = blocked | shifted(hits, dr, dc)
+    scores[blocked] = -1
+    return scores.reshape(len(games), 100).argmax(axis=1)
+
+#Плотность вероятности: для каждой клетки - число возможных положений оставшихся кораблей соперника через нее.
+#Положения через попадания по неуничтоженным кораблям получают большой вес (добивание)
+def density_policy(batch, games, player, rng):
+    hits = batch.hit[games, player].reshape(-1, 10, 10)
+    blocked = batch.blocked[games, player].reshape(-1, 10, 10)
+    for dr, dc in DIAGONAL:
+        blocked = blocked | shifted(hits, dr, dc)
+    free = (~blocked | hits).astype(np.int64)
+    hit_count = hits.astype(np.int64)
+    remaining = batch.remaining[games, player]
+    scores = np.zeros(hits.shape)
+    for length in range(1, 5):
+        count = remaining[:, length]
+        if not count.any():
+            continue
+        #Горизонтальные положения; вертикальные - те же расчеты для транспонированных досок
+        for transpose in ((False, True) if length > 1 else (False,)):
+            f = free.transpose(0, 2, 1) if transpose else free
+            h = hit_count.transpose(0, 2, 1) if transpose else hit_count
+            zeros = np.zeros((len(games), 10, 1), dtype=np.int64)
+            free_sum = np.concatenate([zeros, f.cumsum(axis=2)], axis=2)
+            hit_sum = np.concatenate([zeros, h.cumsum(axis=2)], axis=2)
+            width = 10 - length + 1
+            valid = (free_sum[:, :, length:] - free_sum[:, :, :width]) == length
+            weight = valid * (1 + 20 * (hit_sum[:, :, length:] - hit_sum[:, :, :width])) * count[:, None, None]
+            coverage = np.zeros((len(games), 10, 10))
+            for k in range(length):
+                coverage[:, :, k:k + width] += weight
+            scores += coverage.transpose(0, 2, 1) if transpose else coverage
+    scores += rng.random(scores.shape) * 1e-3
+    scores[blocked] = -1
+    return scores.reshape(len(games), 100).argmax(axis=1)
+
+POLICIES = {
+    "random": random_policy,
+    "hunt": hunt_target_policy,
+    "density": density_policy
+}
+
+#Пакет игр: доски по стратегии расстановки, первый ход - случайно, как при создании игры.
+#Возвращает победителей (0/1), первых игроков, выстрелы игроков и время создания досок и симуляции
+def simulate(games: int, policies=("random", "random"), strategy: str = "uniform", seed: int = None):
+    rng = np.random.default_rng(seed)
+    board_rng = random.Random(seed)
+    start = time.perf_counter()
+    desks = [{"player1": desk_create(strategy, board_rng), "player2": desk_create(strategy, board_rng)} for _ in range(games)]
+    boards_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = Batch(desks, rng.integers(0, 2, games))
+    functions = [POLICIES[name] for name in policies]
+    while batch.step(functions, rng):
+        pass
+    return {
+        "winner": batch.winner,
+        "first": batch.first,
+        "shots": batch.shots,
+        "boards_time": boards_time,
+        "sim_time": time.perf_counter() - start
+    }
+
+def simulate_batch(task):
+    return simulate(*task)
+
+#Все игры пакетами по batch_size, при workers > 1 - в пуле процессов
+def run(games: int, batch_size: int, policies, strategy: str, seed: int, workers: int = 1):
+    tasks = []
+    for i, start in enumerate(range(0, games, batch_size)):
+        tasks.append((min(batch_size, games - start), policies, strategy, None if seed is None else seed + i))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(simulate_batch, tasks))
+    else:
+        results = [simulate_batch(task) for task in tasks]
+    return {
+        "winner": np.concatenate([result["winner"] for result in results]),
+        "first": np.concatenate([result["first"] for result in results]),
+        "shots": np.concatenate([result["shots"] for result in results]),
+        "boards_time": sum(result["boards_time"] for result in results),
+        "sim_time": sum(result["sim_time"] for result in results)
+    }
+
+#Доля и 95% доверительный интервал
+def share(count: int, total: int):
+    p = count / total
+    return f"{p * 100:6.2f}% +- {1.96 * (p * (1 - p) / total) ** 0.5 * 100:.2f}%"
+
+def report(result, policies, elapsed: float):
+    winner, first, shots = result["winner"], result["first"], result["shots"]
+    games = len(winner)
+    total_shots = shots.sum(axis=1)
+    winner_shots = shots[np.arange(games), winner]
+    print(f"Games: {games} in {elapsed:.2f} s - {games / elapsed:.0f} games/sec")
+    print(f"  boards {result['boards_time']:.2f} s, shot resolution {result['sim_time']:.2f} s "
+          f"({games / result['sim_time']:.0f} games/sec, CPU time over all workers)")
+    print(f"  player1 ({policies[0]}) wins   {share(int((winner == 0).sum()), games)}")
+    print(f"  player2 ({policies[1]}) wins   {share(int((winner == 1).sum()), games)}")
+    print(f"  first shooter wins  {share(int((winner == first).sum()), games)}")
+    for name, values in (("shots per game", total_shots), ("winner shots", winner_shots)):
+        p50, p95 = np.percentile(values, [50, 95])
+        print(f"  {name:19} mean {values.mean():6.1f}  p50 {p50:5.0f}  p95 {p95:5.0f}  "
+              f"min {values.min():4d}  max {values.max():4d}")
+    counts = np.bincount(winner_shots // 10, minlength=11)
+    print("  winner shots histogram: " + ", ".join(
+        f"{i * 10}-{i * 10 + 9}: {count}" for i, count in enumerate(counts) if count
+    ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=2000)
+    parser.add_argument("--policy1", choices=POLICIES, default="hunt")
+    parser.add_argument("--policy2", choices=POLICIES, default="hunt")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="uniform")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    policies = (args.policy1, args.policy2)
+    start = time.perf_counter()
+    result = run(args.games, args.batch, policies, args.strategy, args.seed, args.workers)
+    report(result, policies, time.perf_counter() - start)
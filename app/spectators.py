@@ -0,0 +1,266 @@
+import asyncio
+from collections import deque
+import time
+
+from fastapi import WebSocket
+
+from connection_manager import Connection
+from encoding import encode_message
+
+#Клетки публичной доски для зрителей: положение целых кораблей зрителям не передается
+CELL_UNKNOWN = 0
+CELL_MISS = 1
+CELL_HIT = 2
+CELL_SUNK = 3
+#Выстрел по клетке с неизвестным результатом (игры без сохраненных начальных досок)
+CELL_SHOT = -1
+
+#Публичная доска из состояния игры: только клетки, по которым уже стреляли
+def public_board(state, key: str):
+    board = state.desk[key]
+    initial = state.initial_desk[key] if state.initial_desk else None
+    hp = state.fleets[key].hp
+    view = [[CELL_UNKNOWN] * 10 for _ in range(10)]
+    for x in range(10):
+        for y in range(10):
+            if board[x][y] != -1:
+                continue
+            if initial is None:
+                view[x][y] = CELL_SHOT
+            elif initial[x][y] > 0:
+                view[x][y] = CELL_SUNK if hp.get(initial[x][y]) == 0 else CELL_HIT
+            else:
+                view[x][y] = CELL_MISS
+    return view
+
+#Лента одной игры: события ставятся в очередь с задержкой delay и после нее применяются к публичным доскам
+#и рассылаются всем зрителям одной и той же закодированной строкой
+class Feed:
+    def __init__(self, game_id: int, delay: float):
+        self.game_id = game_id
+        self.delay = delay
+        self.viewers: set[Connection] = set()
+        #Отложенные события: (время выдачи, событие)
+        self.pending = deque()
+        self.wake = asyncio.Event()
+        #Выданное зрителям состояние: номер хода, чей ход, публичные доски и закодированный снимок
+        self.seq = 0
+        #Номер хода снимка, с которого начата лента
+        self.base_seq = 0
+        self.turn = None
+        self.boards = None
+        self.winner = None
+        self.over = False
+        self.snapshot = None
+        self.linger = 5.0
+        self.task = asyncio.get_running_loop().create_task(self.pump())
+
+    def push(self, event: dict):
+        self.pending.append((time.monotonic() + self.delay, event))
+        self.wake.set()
+
+    #Фоновая задача ленты: выдача событий, время которых пришло
+    async def pump(self):
+        while True:
+            if not self.pending:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            due, event = self.pending[0]
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self.pending.popleft()
+            message = self.apply(event)
+            if message is not None:
+                self.send(message)
+            #После конца игры даем зрителям получить последние события и закрываем их сокеты
+            if self.over:
+                await asyncio.sleep(self.linger)
+                for viewer in list(self.viewers):
+                    viewer.kill(close=True)
+                return
+
+    #Применение события к публичному состоянию. Возвращает закодированное сообщение для зрителей или None
+    def apply(self, event: dict):
+        if event["type"] == "spectate_info":
+            self.base_seq = self.seq = event["seq"]
+            self.turn = event["turn"]
+            self.boards = event["boards"]
+            self.snapshot = None
+            return self.encoded_snapshot()
+
+        #События, уже вошедшие в снимок, пропускаем. События с другого воркера могут прийти не по порядку:
+        #клетки от порядка не зависят, номер хода и чей ход берутся из самого позднего события
+        if self.boards is None or event.get("seq", self.base_seq + 1) <= self.base_seq:
+            return None
+
+        if event["type"] == "shot":
+            board = self.boards[event["board"]]
+            if event["kill"]:
+                for x, y in event["ship_cells"]:
+                    board[x][y] = CELL_SUNK
+            elif board[event["col"]][event["row"]] != CELL_SUNK:
+                board[event["col"]][event["row"]] = CELL_HIT if event["hit"] else CELL_MISS
+            if event["seq"] > self.seq:
+                self.seq = event["seq"]
+                self.turn = event["turn"]
+        elif event["type"] == "spectate_end":
+            self.over = True
+            self.winner = event["winner"]
+        self.snapshot = None
+        return encode_message(event)
+
+    #Снимок для новых и отставших зрителей. Кодируется один раз на состояние ленты
+    def encoded_snapshot(self):
+        if self.snapshot is None and self.boards is not None:
+            self.snapshot = encode_message({
+                "type": "spectate_info",
+                "seq": self.seq,
+                "turn": self.turn,
+                "board1": self.boards["player1"],
+                "board2": self.boards["player2"],
+                "game_over": self.over,
+                "winner": self.winner
+            })
+        return self.snapshot
+
+    #Рассылка события. Зритель с полной очередью вместо всех отставших событий получает один актуальный снимок
+    def send(self, message: str):
+        for viewer in list(self.viewers):
+            if len(viewer.queue) >= viewer.max_queue:
+                viewer.reset(self.encoded_snapshot())
+            else:
+                viewer.send(message)
+
+    def stop(self):
+        self.task.cancel()
+        for viewer in list(self.viewers):
+            viewer.kill()
+
+#Зрители игр. Ход игрока не делает запросов к БД и не сериализует сообщения для каждого зрителя:
+#если у игры есть зрители (на этом или другом воркере), публичное событие кодируется один раз и ставится в ленту.
+#Ленты создаются при подключении первого зрителя игры и удаляются после ухода последнего.
+#Другие воркеры узнают о зрителях игры через шину менеджера
+class Spectators:
+    def __init__(self, manager, games_state, delay: float = 0.0, max_queue: int = 32):
+        self.manager = manager
+        self.games_state = games_state
+        self.delay = delay
+        self.max_queue = max_queue
+        self.feeds: dict[int, Feed] = {}
+        #Воркеры, у которых есть зрители игры: id игры -> множество id воркеров
+        self.remote: dict[int, set[str]] = {}
+        self.sockets: dict[WebSocket, Connection] = {}
+        manager.subscribe("spectate", self.on_spectate)
+        manager.subscribe("watchers", self.on_watchers)
+
+    #У игры есть зрители на каком-либо воркере
+    def watched(self, game_id: int):
+        return game_id in self.feeds or game_id in self.remote
+
+    def viewer_count(self):
+        return len(self.sockets)
+
+    #Подключение зрителя. False - игра не найдена или уже закончилась
+    async def watch(self, websocket: WebSocket, game_id: int):
+        feed = self.feeds.get(game_id)
+        if feed is None:
+            #Состояние берем из памяти процесса, иначе читаем из БД без добавления в память: игрой владеет другой воркер
+            state = self.games_state.games.get(game_id)
+            if state is None:
+                state = await self.games_state.load(game_id)
+            if state is None:
+                return False
+            #Пока шел запрос, ленту мог создать другой зритель
+            feed = self.feeds.get(game_id)
+            if feed is None:
+                feed = self.feeds[game_id] = Feed(game_id, self.delay)
+                async with state.lock:
+                    feed.push({
+                        "type": "spectate_info",
+                        "seq": state.seq,
+                        "turn": state.current_turn,
+                        "boards": {key: public_board(state, key) for key in ("player1", "player2")}
+                    })
+                await self.manager.publish({"kind": "watchers", "game_id": game_id, "watching": True})
+
+        await websocket.accept()
+        viewer = Connection(websocket, game_id, self.max_queue, "drop", self.on_dead)
+        self.sockets[websocket] = viewer
+        feed.viewers.add(viewer)
+        #Снимок уже выданной ленты отправляем сразу, иначе зритель получит его вместе с остальными по истечении задержки
+        snapshot = feed.encoded_snapshot()
+        if snapshot is not None:
+            viewer.send(snapshot)
+        return True
+
+    def leave(self, websocket: WebSocket):
+        viewer = self.sockets.pop(websocket, None)
+        if viewer is None:
+            return
+        viewer.kill()
+        feed = self.feeds.get(viewer.game_id)
+        if feed is None:
+            return
+        feed.viewers.discard(viewer)
+        if not feed.viewers:
+            del self.feeds[viewer.game_id]
+            feed.stop()
+            asyncio.get_running_loop().create_task(
+                self.manager.publish({"kind": "watchers", "game_id": viewer.game_id, "watching": False})
+            )
+
+    def on_dead(self, viewer: Connection):
+        self.leave(viewer.websocket)
+
+    #Публичное событие игры (вызывается только для игр со зрителями): в свою ленту и на воркеры со зрителями
+    async def publish(self, game_id: int, event: dict):
+        self.push(game_id, event)
+        await self.publish_remote(game_id, event)
+
+    #Событие в ленту этого процесса, без ожидания
+    def push(self, game_id: int, event: dict):
+        feed = self.feeds.get(game_id)
+        if feed is not None:
+            feed.push(event)
+
+    async def publish_remote(self, game_id: int, event: dict):
+        if game_id in self.remote:
+            await self.manager.publish({"kind": "spectate", "game_id": game_id, "event": event})
+
+    #Выстрел игрока: результат без положения неподбитых кораблей. Клетки корабля передаются только после его уничтожения
+    def shot_event(self, state, player_id: int, col: int, row: int, result: dict):
+        event = {
+            "type": "shot",
+            "seq": state.seq,
+            "player": player_id,
+            "board": "player2" if player_id == state.player1_id else "player1",
+            "col": col,
+            "row": row,
+            "hit": result["hit"],
+            "kill": result["kill"],
+            "turn": state.current_turn,
+            "game_over": result["game_over"]
+        }
+        if result["kill"]:
+            event["ship_cells"] = result["ship_cells"]
+        return event
+
+    async def game_ended(self, game_id: int, winner_id: int):
+        await self.publish(game_id, {"type": "spectate_end", "winner": winner_id})
+
+    async def on_spectate(self, event: dict):
+        feed = self.feeds.get(event["game_id"])
+        if feed is not None:
+            feed.push(event["event"])
+
+    async def on_watchers(self, event: dict):
+        workers = self.remote.setdefault(event["game_id"], set())
+        if event["watching"]:
+            workers.add(event["worker"])
+        else:
+            workers.discard(event["worker"])
+            if not workers:
+                del self.remote[event["game_id"]]
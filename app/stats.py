@@ -0,0 +1,99 @@
+from sqlalchemy import update, insert, case, func, or_, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from models import Game, GameArchive, PlayerStats
+
+#Учет результата игры в сводке игрока (в текущей транзакции).
+#Обновление считается в SQL от текущих значений строки, поэтому одновременные игры одного игрока не теряют друг друга
+async def record_result(db, player_id: int, won: bool, moves: int, seconds: int, date_ended):
+    streak = PlayerStats.current_streak
+    if won:
+        new_streak = case((streak > 0, streak + 1), else_=1)
+        values = {
+            "wins": PlayerStats.wins + 1,
+            "longest_win_streak": case((new_streak > PlayerStats.longest_win_streak, new_streak),
+                                       else_=PlayerStats.longest_win_streak)
+        }
+    else:
+        new_streak = case((streak < 0, streak - 1), else_=-1)
+        values = {
+            "losses": PlayerStats.losses + 1,
+            "longest_loss_streak": case((-new_streak > PlayerStats.longest_loss_streak, -new_streak),
+                                        else_=PlayerStats.longest_loss_streak)
+        }
+    request = update(PlayerStats).where(PlayerStats.player_id == player_id).values(
+        games=PlayerStats.games + 1,
+        current_streak=new_streak,
+        total_moves=PlayerStats.total_moves + moves,
+        total_seconds=PlayerStats.total_seconds + seconds,
+        first_game=func.coalesce(PlayerStats.first_game, date_ended),
+        last_game=date_ended,
+        **values
+    )
+    if (await db.execute(request)).rowcount == 1:
+        return
+
+    #Первая игра игрока. Если строку только что вставил другой процесс, обновляем ее
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(PlayerStats).values(
+                player_id=player_id, games=1, wins=int(won), losses=int(not won),
+                current_streak=1 if won else -1,
+                longest_win_streak=int(won), longest_loss_streak=int(not won),
+                total_moves=moves, total_seconds=seconds,
+                first_game=date_ended, last_game=date_ended
+            ))
+    except IntegrityError:
+        await db.execute(request)
+
+#Учет завершенной игры в сводках обоих игроков
+async def record_game(db, player1_id: int, player2_id: int, winner_id: int, moves: int, date_created, date_ended):
+    seconds = int((date_ended - date_created).total_seconds()) if date_created else 0
+    for player_id in (player1_id, player2_id):
+        await record_result(db, player_id, player_id == winner_id, moves, seconds, date_ended)
+
+#Сводка игрока для API. Все показатели считаются из одной строки player_stats
+def stats_info(player_id: int, stats: PlayerStats = None):
+    if stats is None or not stats.games:
+        return {
+            "player": player_id, "games": 0, "wins": 0, "losses": 0, "win_rate": 0.0,
+            "current_streak": 0, "longest_win_streak": 0, "longest_loss_streak": 0,
+            "avg_moves": 0.0, "avg_seconds": 0.0, "games_per_day": 0.0
+        }
+    days = (stats.last_game.date() - stats.first_game.date()).days + 1
+    return {
+        "player": player_id,
+        "games": stats.games,
+        "wins": stats.wins,
+        "losses": stats.losses,
+        "win_rate": round(stats.wins / stats.games, 4),
+        "current_streak": stats.current_streak,
+        "longest_win_streak": stats.longest_win_streak,
+        "longest_loss_streak": stats.longest_loss_streak,
+        "avg_moves": round(stats.total_moves / stats.games, 2),
+        "avg_seconds": round(stats.total_seconds / stats.games, 2),
+        "games_per_day": round(stats.games / days, 4)
+    }
+
+#Игры и победы игрока по дням, начиная с since: агрегат в SQL по узким колонкам games и архива games_archive
+#(индексы ix_games_player1_ended, ix_games_player2_ended и такие же индексы архива)
+def daily_stats_request(player_id: int, since):
+    games = union_all(*(
+        select(table.date_ended, table.winner_id)
+        .where(or_(table.player1_id == player_id, table.player2_id == player_id), table.date_ended >= since)
+        for table in (Game, GameArchive)
+    )).subquery()
+    day = func.date(games.c.date_ended)
+    return (
+        select(day, func.count(), func.sum(case((games.c.winner_id == player_id, 1), else_=0)))
+        .group_by(day)
+        .order_by(day)
+    )
+
+async def daily_stats(db, player_id: int, since):
+    result = await db.execute(daily_stats_request(player_id, since))
+    return [
+        {"date": str(date), "games": games, "wins": int(wins)}
+        for date, games, wins in result.all()
+    ]
@@ -0,0 +1,99 @@
+from sqlalchemy import create_engine, text, update, select, insert, bindparam, null, func
+from app.models import Base, Game, Move, PlayerStats
+from app.game_logic import pack_desk, load_desk
+import sys
+
+DB_HOST = 'localhost'
+DB_NAME = 'fast_api'
+DB_USER = 'admin'
+DB_PASSWORD = 'password'
+
+#Обновление существующей БД до текущей схемы app/models.py (Postgres)
+#python migrate_db.py [--drop-json] - --drop-json очищает старые JSON-колонки досок после переноса
+BATCH_SIZE = 1000
+
+database_url = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
+engine = create_engine(database_url)
+
+#Новые колонки games
+with engine.begin() as conn:
+    conn.execute(text("ALTER TABLE games ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text("ALTER TABLE games ADD COLUMN IF NOT EXISTS snapshot_seq INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text("ALTER TABLE games ADD COLUMN IF NOT EXISTS initial_desk JSON"))
+    conn.execute(text("ALTER TABLE games ADD COLUMN IF NOT EXISTS desk_data BYTEA"))
+    conn.execute(text("ALTER TABLE games ADD COLUMN IF NOT EXISTS initial_desk_data BYTEA"))
+    conn.execute(text("ALTER TABLE games ALTER COLUMN desk DROP NOT NULL"))
+
+#Новые таблицы и индексы существующих таблиц
+Base.metadata.create_all(engine)
+for index in Game.__table__.indexes:
+    index.create(engine, checkfirst=True)
+
+#Перенос досок из JSON (JSON-строка внутри JSON) в упакованные колонки пачками по BATCH_SIZE строк
+converted = 0
+while True:
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(Game.id, Game.desk, Game.initial_desk)
+            .where(Game.desk_data.is_(None), Game.desk.isnot(None))
+            .order_by(Game.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            update(Game)
+            .where(Game.id == bindparam('game_id'))
+            .values(desk_data=bindparam('packed'), initial_desk_data=bindparam('initial_packed')),
+            [
+                {
+                    "game_id": game_id,
+                    "packed": pack_desk(load_desk(None, desk)),
+                    "initial_packed": pack_desk(load_desk(None, initial_desk)) if initial_desk is not None else None
+                }
+                for game_id, desk, initial_desk in rows
+            ]
+        )
+        converted += len(rows)
+        print(f"Converted {converted} games")
+
+#Заполнение сводок статистики игроков (player_stats) по уже завершенным играм, если таблица пустая.
+#Игры читаются по порядку окончания узкими колонками, серии считаются за один проход
+with engine.begin() as conn:
+    if conn.execute(select(func.count()).select_from(PlayerStats)).scalar_one() == 0:
+        moves = select(Move.game_id, func.max(Move.seq).label('moves')).group_by(Move.game_id).subquery()
+        rows = conn.execution_options(stream_results=True).execute(
+            select(Game.player1_id, Game.player2_id, Game.winner_id, Game.date_created, Game.date_ended,
+                   func.coalesce(moves.c.moves, 0))
+            .outerjoin(moves, moves.c.game_id == Game.id)
+            .where(Game.date_ended.isnot(None))
+            .order_by(Game.date_ended)
+        )
+        stats = {}
+        for player1_id, player2_id, winner_id, date_created, date_ended, game_moves in rows:
+            seconds = int((date_ended - date_created).total_seconds()) if date_created else 0
+            for player_id in (player1_id, player2_id):
+                row = stats.setdefault(player_id, {
+                    "player_id": player_id, "games": 0, "wins": 0, "losses": 0, "current_streak": 0,
+                    "longest_win_streak": 0, "longest_loss_streak": 0, "total_moves": 0, "total_seconds": 0,
+                    "first_game": date_ended, "last_game": date_ended
+                })
+                row["games"] += 1
+                row["total_moves"] += game_moves
+                row["total_seconds"] += seconds
+                row["last_game"] = date_ended
+                if player_id == winner_id:
+                    row["wins"] += 1
+                    row["current_streak"] = row["current_streak"] + 1 if row["current_streak"] > 0 else 1
+                    row["longest_win_streak"] = max(row["longest_win_streak"], row["current_streak"])
+                else:
+                    row["losses"] += 1
+                    row["current_streak"] = row["current_streak"] - 1 if row["current_streak"] < 0 else -1
+                    row["longest_loss_streak"] = max(row["longest_loss_streak"], -row["current_streak"])
+        if stats:
+            conn.execute(insert(PlayerStats), list(stats.values()))
+        print(f"Player stats for {len(stats)} players")
+
+if '--drop-json' in sys.argv:
+    with engine.begin() as conn:
+        conn.execute(update(Game).where(Game.desk_data.isnot(None)).values(desk=null(), initial_desk=null()))
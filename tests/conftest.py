@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool
+
+#Модули приложения импортируются как в app/main.py: from models import ...
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from models import Base
+
+#Фабрика сессий временной БД SQLite с таблицами приложения. Без пула: каждый тест запускает свой цикл событий
+@pytest.fixture
+def session_factory(tmp_path):
+    path = tmp_path / "test.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    return async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+#Приложение (app/main.py) на временной БД SQLite, одной на все тесты: модуль main импортируется один раз
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    path = tmp_path_factory.mktemp("app") / "app.db"
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+    import main
+    return main
+
+#Клиент приложения с запущенными фоновыми задачами (lifespan)
+@pytest.fixture
+def client(main):
+    from starlette.testclient import TestClient
+    with TestClient(main.app) as client:
+        yield client
+
+#Новые игроки в БД приложения: список id
+@pytest.fixture
+def new_players(client):
+    def create(count):
+        ids = []
+        for _ in range(count):
+            login = f"player_{os.urandom(4).hex()}"
+            client.post("/players/register", json={"login": login, "password": "password"})
+            ids.append(client.post("/players/login", json={"login": login, "password": "password"}).json()["player_id"])
+        return ids
+    return create
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+def create_game(client, player1, player2):
+    return client.post("/games/create", json={"player1": player1, "player2": player2}).json()
+
+#Сокет без действительного токена закрывается до загрузки игры в память
+def test_game_ws_rejects_bad_token_without_loading_game(main, client, new_players):
+    player1, player2 = new_players(2)
+    game_id = create_game(client, player1, player2)["game_id"]
+    for token in ("junk", main.issue_token(player1, "other-secret", 60)):
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect(f"/games/{game_id}/play?token={token}"):
+                pass
+        assert error.value.code == 1002
+    assert game_id not in main.games_state.games
+
+def active_game_players(client):
+    return {game["id"]: (game["player1"], game["player2"]) for game in client.get("/games", params={"limit": 1000}).json()}
+
+#Два одновременных запроса с общим игроком: игрок резервируется сразу после проверки, вторая игра не создается
+def test_concurrent_create_does_not_double_book(main, client, new_players):
+    player1, player2, player3 = new_players(3)
+
+    async def scenario():
+        async def create(opponent):
+            async with main.ASession() as db:
+                return await main.game_create(main.Players_Game(player1=player1, player2=opponent), db)
+        return await asyncio.gather(create(player2), create(player3))
+
+    results = client.portal.call(scenario)
+    assert sorted(result["status"] for result in results) == ["false", "true"]
+    game_id = next(result["game_id"] for result in results if result["status"] == "true")
+    assert main.presence.busy[player1] == game_id
+    assert not main.presence.reserved
+
+def test_create_bulk_maps_ids_to_pairs(main, client, new_players):
+    players = new_players(6)
+    pairs = [{"player1": players[i], "player2": players[i + 1]} for i in range(0, 6, 2)]
+    response = client.post("/games/create_bulk", json={"games": pairs}).json()
+    assert response["status"] == "true"
+    games = active_game_players(client)
+    assert [games[game_id] for game_id in response["game_ids"]] == [(pair["player1"], pair["player2"]) for pair in pairs]
+    assert all(main.presence.busy[player_id] == game_id
+               for game_id, pair in zip(response["game_ids"], pairs) for player_id in pair.values())
+
+def test_create_bulk_validation(main, client, new_players):
+    player1, player2, player3, player4 = new_players(4)
+    busy1, busy2 = new_players(2)
+    create_game(client, busy1, busy2)
+    before = active_game_players(client)
+    cases = [
+        ([], None),
+        ([(player1, player1)], [player1]),
+        ([(player1, player2), (player3, player1)], [player1]),
+        ([(player1, player2), (player3, 10**6)], [10**6]),
+        ([(player1, player2), (player3, busy1)], [busy1]),
+    ]
+    for pairs, players in cases:
+        response = client.post("/games/create_bulk", json={"games": [{"player1": a, "player2": b} for a, b in pairs]}).json()
+        assert response["status"] == "false"
+        assert response.get("players") == players
+    assert active_game_players(client) == before
+    assert not any(main.presence.is_busy(player_id) for player_id in (player1, player2, player3, player4))
+
+#Ошибка записи снимает резерв: игроки остаются свободными
+def test_create_bulk_failure_releases_players(main, client, new_players, monkeypatch):
+    player1, player2 = new_players(2)
+
+    async def fail(count):
+        raise RuntimeError("no boards")
+    monkeypatch.setattr(main.boards_pool, "take_many", fail)
+    with pytest.raises(RuntimeError):
+        client.post("/games/create_bulk", json={"games": [{"player1": player1, "player2": player2}]})
+    assert not main.presence.is_busy(player1) and not main.presence.is_busy(player2)
+
+def test_player_stats_days_bounds(client, new_players):
+    player_id, = new_players(1)
+    for days in (0, -1, 367, 1000000):
+        assert client.get(f"/players/{player_id}/stats", params={"days": days}).status_code == 422
+    response = client.get(f"/players/{player_id}/stats", params={"days": 366})
+    assert response.status_code == 200 and response.json()["daily"] == []
+    assert "daily" not in client.get(f"/players/{player_id}/stats").json()
+
+#Обход страниц по заголовку X-Next-After
+def walk_pages(client, url, limit):
+    items, after = [], 0
+    while after is not None:
+        response = client.get(url, params={"after": after, "limit": limit})
+        assert response.status_code == 200 and len(response.json()) <= limit
+        items += response.json()
+        after = response.headers.get("X-Next-After")
+    return items
+
+def test_players_pages(main, client, new_players):
+    player1, player2, player3, player4 = new_players(4)
+    create_game(client, player2, player3)
+    for limit in (0, -1, 1001):
+        assert client.get("/players", params={"limit": limit}).status_code == 422
+    assert len(client.get("/players").json()) <= main.PAGE_SIZE
+
+    ids = [player["id"] for player in walk_pages(client, "/players", 2)]
+    assert len(ids) == len(set(ids)) and ids == sorted(ids)
+    assert player1 in ids and player4 in ids
+    assert player2 not in ids and player3 not in ids
+    assert ids == [player["id"] for player in client.get("/players", params={"limit": 1000}).json()]
+
+def test_games_pages(main, client, new_players):
+    players = new_players(6)
+    for i in range(0, 6, 2):
+        create_game(client, players[i], players[i + 1])
+    for limit in (0, -5, 1001):
+        assert client.get("/games", params={"limit": limit}).status_code == 422
+    assert len(client.get("/games").json()) <= main.PAGE_SIZE
+
+    games = walk_pages(client, "/games", 2)
+    ids = [game["id"] for game in games]
+    assert len(ids) == len(set(ids)) and ids == sorted(ids)
+    assert set(ids) == set(active_game_players(client))
+    #Потоковая выдача без limit - все активные игры
+    stream = client.get("/games", params={"stream": "true"})
+    assert [json.loads(line)["id"] for line in stream.text.splitlines()] == ids
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+from archive import pack_moves, unpack_moves
+
+#Бит 4 второго байта - ход второго игрока, младшие два бита - результат
+def test_pack_moves_round_trip_with_player2_bit():
+    moves = [
+        SimpleNamespace(player_id=1, col=0, row=0, result=0),
+        SimpleNamespace(player_id=2, col=9, row=9, result=1),
+        SimpleNamespace(player_id=2, col=3, row=7, result=2),
+        SimpleNamespace(player_id=1, col=7, row=3, result=2),
+    ]
+    data = pack_moves(moves, player2_id=2)
+    assert unpack_moves(data, 1, 2) == [
+        {"seq": 1, "player": 1, "col": 0, "row": 0, "result": 0},
+        {"seq": 2, "player": 2, "col": 9, "row": 9, "result": 1},
+        {"seq": 3, "player": 2, "col": 3, "row": 7, "result": 2},
+        {"seq": 4, "player": 1, "col": 7, "row": 3, "result": 2},
+    ]
+
+def test_pack_moves_empty():
+    assert unpack_moves(pack_moves([], player2_id=2), 1, 2) == []
@@ -0,0 +1,67 @@
+import copy
+import json
+
+import pytest
+
+from game_logic import pack_desk, unpack_desk, load_desk, get_desks, Fleet, DESK_FORMAT_NIBBLE
+
+def test_pack_desk_round_trip():
+    desk = get_desks(seed=1)
+    data = pack_desk(desk)
+    assert len(data) == 101 and data[0] == DESK_FORMAT_NIBBLE
+    assert unpack_desk(data) == desk
+
+#Границы значения клетки: -1 (выстрел) и 10 (последний корабль) в полубайтах 0 и 11
+def test_pack_desk_nibble_bounds():
+    board = [[-1] * 10 for _ in range(10)]
+    board[0][1] = 10
+    board[9][9] = 0
+    desk = {"player1": board, "player2": [[10] * 10 for _ in range(10)]}
+    data = pack_desk(desk)
+    assert data[1] == 0x0B
+    assert unpack_desk(data) == desk
+
+def test_unpack_desk_unknown_format():
+    with pytest.raises(ValueError):
+        unpack_desk(bytes([99]) + bytes(100))
+
+#Старый формат: JSON-строка внутри JSON-колонки. После загрузки упаковывается как обычная доска
+def test_load_desk_legacy_json_string():
+    desk = get_desks(seed=2)
+    legacy = json.dumps(desk)
+    assert load_desk(None, legacy) == desk
+    assert load_desk(None, desk) == desk
+    assert unpack_desk(pack_desk(load_desk(None, legacy))) == desk
+    assert load_desk(None, None) is None
+
+def test_load_desk_prefers_packed():
+    desk = get_desks(seed=3)
+    assert load_desk(pack_desk(desk), json.dumps(get_desks(seed=4))) == desk
+
+def ship_cells(board, index):
+    return [(x, y) for x in range(10) for y in range(10) if board[x][y] == index]
+
+def test_fleet_kill_and_destroyed():
+    board = get_desks(seed=1)["player1"]
+    fleet = Fleet(board)
+    assert fleet.alive == 20
+    #Корабль 10 - одна клетка, корабль 1 - четыре
+    assert fleet.hit(10) is True
+    assert [fleet.hit(1) for _ in range(4)] == [False, False, False, True]
+    assert fleet.ship_cells(1) == ship_cells(board, 1)
+    assert not fleet.destroyed()
+    for index in range(2, 10):
+        while not fleet.hit(index):
+            pass
+    assert fleet.destroyed()
+
+#Без начальной доски подбитые клетки в корабль не попадают, с начальной - попадают
+def test_fleet_cells_from_initial_desk():
+    initial = get_desks(seed=1)["player1"]
+    board = copy.deepcopy(initial)
+    x, y = ship_cells(initial, 1)[0]
+    board[x][y] = -1
+    assert (x, y) not in Fleet(board).ship_cells(1)
+    fleet = Fleet(board, initial)
+    assert (x, y) in fleet.ship_cells(1)
+    assert fleet.hp[1] == 3
@@ -0,0 +1,62 @@
+import copy
+from types import SimpleNamespace
+
+from game_logic import get_desks
+from game_state import GameState
+
+def make_state(seed=1, events_size=4):
+    desk = get_desks(seed=seed)
+    return GameState(1, 1, 2, 1, copy.deepcopy(desk), initial_desk=desk, events_size=events_size)
+
+def test_events_after():
+    state = make_state()
+    assert state.events_after(0) == []
+    for seq in range(1, 7):
+        state.seq = seq
+        state.record_event(f"m{seq}")
+    #В буфере ходы 3-6
+    assert state.events_after(6) == []
+    assert state.events_after(4) == ["m5", "m6"]
+    assert state.events_after(2) == ["m3", "m4", "m5", "m6"]
+    assert state.events_after(1) is None
+    assert state.events_after(7) is None
+
+#Ходы из журнала не попадают в буфер: клиент, пропустивший их, получает снимок
+def test_replay_clears_events():
+    state = make_state()
+    state.move(1, 0, 0)
+    state.record_event("m1")
+    assert state.events_after(0) == ["m1"]
+    state.replay([SimpleNamespace(player_id=state.current_turn, col=1, row=1)])
+    assert state.seq == 2 and not state.dirty
+    assert state.events_after(0) is None
+
+def sink_fleet(state, player_id, target):
+    board = state.desk[target]
+    result = None
+    for x, y in [(x, y) for x in range(10) for y in range(10) if board[x][y] > 0]:
+        result = state.move(player_id, x, y)
+    return result
+
+def test_winner_and_no_moves_after_game_over():
+    state = make_state()
+    result = sink_fleet(state, 1, "player2")
+    assert result["game_over"] and state.winner == 1
+    seq = state.seq
+    assert state.move(1, 0, 0) is None
+    assert state.seq == seq and state.current_turn == 1
+
+#Победитель восстанавливается при загрузке состояния из снимка досок
+def test_winner_from_loaded_desk():
+    state = make_state()
+    sink_fleet(state, 1, "player2")
+    loaded = GameState(1, 1, 2, state.current_turn, copy.deepcopy(state.desk), initial_desk=state.initial_desk, seq=state.seq)
+    assert loaded.winner == 1
+    assert make_state().winner is None
+
+def test_already_shot():
+    state = make_state()
+    assert not state.already_shot(1, 3, 4)
+    state.move(1, 3, 4)
+    assert state.already_shot(1, 3, 4)
+    assert not state.already_shot(2, 3, 4)
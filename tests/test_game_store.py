@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from models import Game, Move, PlayerStats
+from game_logic import pack_desk, get_desks
+from game_state import GameStateStore
+
+async def add_game(session_factory, current_turn=1, seed=1):
+    desk = pack_desk(get_desks(seed=seed))
+    game = Game(desk_data=desk, initial_desk_data=desk, player1_id=1, player2_id=2, current_turn=current_turn)
+    async with session_factory() as db:
+        db.add(game)
+        await db.commit()
+    return game.id
+
+async def count_moves(session_factory, game_id):
+    async with session_factory() as db:
+        return (await db.execute(select(func.count()).select_from(Move).where(Move.game_id == game_id))).scalar_one()
+
+#Выстрел мимо кораблей доски соперника
+def miss(state, player_id):
+    board = state.desk["player2" if player_id == state.player1_id else "player1"]
+    return next((x, y) for x in range(10) for y in range(10) if board[x][y] == 0)
+
+def test_evict_writes_and_forgets_idle_game(session_factory):
+    async def scenario():
+        store = GameStateStore(session_factory, 0)
+        game_id = await add_game(session_factory)
+        state = await store.get(game_id)
+        state.move(1, *miss(state, 1))
+        await store.evict(game_id)
+        assert game_id not in store.games
+        assert await count_moves(session_factory, game_id) == 1
+        assert (await store.get(game_id)).seq == 1
+    asyncio.run(scenario())
+
+#Игрок переподключился и сделал ход, пока выгружаемая игра записывалась: состояние с ходом остается в памяти
+def test_evict_keeps_game_reconnected_during_flush(session_factory):
+    async def scenario():
+        connected = set()
+        store = GameStateStore(session_factory, 0)
+        store.in_use = lambda game_id: game_id in connected
+        game_id = await add_game(session_factory)
+        state = await store.get(game_id)
+        state.move(1, *miss(state, 1))
+
+        evict = asyncio.create_task(store.evict(game_id))
+        await asyncio.sleep(0)
+        assert state.lock.locked()
+        connected.add(game_id)
+        assert await store.get(game_id) is state
+        async with state.lock:
+            assert state.move(2, *miss(state, 2)) is not None
+        await evict
+
+        assert store.games.get(game_id) is state
+        await store.flush([game_id])
+        assert await count_moves(session_factory, game_id) == 2
+        assert (await store.load(game_id)).seq == 2
+    asyncio.run(scenario())
+
+#Игра открыта на двух воркерах: ход сделан через другой процесс, а forfeit выбирает проигравшего по ходу из БД
+def test_finish_forfeit_syncs_moves_of_other_worker(session_factory):
+    async def scenario():
+        worker1 = GameStateStore(session_factory, 0)
+        worker2 = GameStateStore(session_factory, 0)
+        game_id = await add_game(session_factory, current_turn=1)
+        state1 = await worker1.get(game_id)
+        state2 = await worker2.get(game_id)
+        await worker1.apply_locked(state1, lambda: state1.move(1, *miss(state1, 1)))
+        assert state2.current_turn == 1 and state2.seq == 0
+
+        assert await worker2.finish(state2, datetime.datetime(2026, 1, 1), forfeit=True)
+        assert state2.winner == 1 and state2.finished
+        assert game_id not in worker2.games
+        async with session_factory() as db:
+            game = await db.get(Game, game_id)
+            assert game.winner_id == 1 and game.snapshot_seq == 1
+            stats = {row.player_id: row for row in (await db.execute(select(PlayerStats))).scalars()}
+        assert stats[1].wins == 1 and stats[2].losses == 1
+        assert stats[1].total_moves == stats[2].total_moves == 1
+        #Второй процесс уже не завершит игру повторно
+        assert not await worker1.finish(state1, datetime.datetime(2026, 1, 1), forfeit=True)
+    asyncio.run(scenario())
+
+def test_finish_without_winner_needs_forfeit(session_factory):
+    async def scenario():
+        store = GameStateStore(session_factory, 0)
+        game_id = await add_game(session_factory)
+        state = await store.get(game_id)
+        state.move(1, *miss(state, 1))
+        assert not await store.finish(state, datetime.datetime(2026, 1, 1))
+        assert store.games.get(game_id) is state and not state.finished
+        #Forfeit без ходов - отмена игры без победителя и без статистики
+        other = await store.get(await add_game(session_factory))
+        assert await store.finish(other, datetime.datetime(2026, 1, 1), forfeit=True)
+        assert other.winner is None
+        async with session_factory() as db:
+            assert (await db.execute(select(func.count()).select_from(PlayerStats))).scalar_one() == 0
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import messages
+from messages import parse_game_message, TokenBucket, MoveMessage
+
+def test_parse_move():
+    message, error = parse_game_message('{"type": "move", "col": 9, "row": 0}')
+    assert error is None
+    assert message == MoveMessage(type="move", col=9, row=0)
+
+def test_parse_errors():
+    cases = {
+        'not json': "Wrong message format",
+        '[1]': "Wrong message format",
+        '{"type": "hello"}': "Unknown message type",
+        '{}': "Unknown message type",
+        '{"type": "move", "col": 10, "row": 0}': "Wrong message fields",
+        '{"type": "move", "col": -1, "row": 0}': "Wrong message fields",
+        '{"type": "move", "col": "1", "row": 0}': "Wrong message fields",
+        '{"type": "move", "col": 1.5, "row": 0}': "Wrong message fields",
+        '{"type": "move", "col": true, "row": 0}': "Wrong message fields",
+        '{"type": "move", "col": 1}': "Wrong message fields",
+    }
+    for data, expected in cases.items():
+        assert parse_game_message(data) == (None, expected), data
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(messages.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    now[0] += 0.5
+    assert bucket.take() is True
+    assert bucket.take() is False
+    #Токены не копятся больше burst
+    now[0] += 60
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
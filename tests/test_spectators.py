@@ -0,0 +1,81 @@
+import asyncio
+import copy
+import random
+
+from game_logic import get_desks
+from game_state import GameState
+from connection_manager import ConnectionManager
+from spectators import Spectators, Feed, public_board, CELL_UNKNOWN, CELL_MISS, CELL_HIT, CELL_SUNK, CELL_SHOT
+
+def make_state(seed=1, initial=True):
+    desk = get_desks(seed=seed)
+    return GameState(1, 1, 2, 1, copy.deepcopy(desk), initial_desk=desk if initial else None)
+
+def cells(board, test):
+    return [(x, y) for x in range(10) for y in range(10) if test(board[x][y])]
+
+#Необстрелянные клетки публичной доски всегда 0, целые клетки кораблей не видны
+def assert_no_hidden_ships(state, view, key):
+    for x, y in cells(state.desk[key], lambda value: value != -1):
+        assert view[x][y] == CELL_UNKNOWN
+
+def test_public_board_hides_unsunk_ships():
+    state = make_state()
+    assert public_board(state, "player2") == [[CELL_UNKNOWN] * 10 for _ in range(10)]
+
+    initial = state.initial_desk["player2"]
+    ship = cells(initial, lambda value: value == 1)
+    water = cells(initial, lambda value: value == 0)
+    #Попадание в корабль из четырех клеток: видна только подбитая клетка
+    state.move(1, *ship[0])
+    view = public_board(state, "player2")
+    assert view[ship[0][0]][ship[0][1]] == CELL_HIT
+    assert_no_hidden_ships(state, view, "player2")
+    #Корабль уничтожен: все его клетки 3, клетки вокруг по-прежнему не раскрыты
+    for x, y in ship[1:]:
+        state.move(1, x, y)
+    view = public_board(state, "player2")
+    assert all(view[x][y] == CELL_SUNK for x, y in ship)
+    assert_no_hidden_ships(state, view, "player2")
+    state.move(1, *water[0])
+    assert public_board(state, "player2")[water[0][0]][water[0][1]] == CELL_MISS
+    assert public_board(state, "player1") == [[CELL_UNKNOWN] * 10 for _ in range(10)]
+
+#Без начальных досок результат выстрела по снимку неизвестен: только отметка выстрела
+def test_public_board_without_initial_desk():
+    state = make_state(initial=False)
+    target = cells(state.desk["player2"], lambda value: value == 1)[0]
+    state.move(1, *target)
+    view = public_board(state, "player2")
+    assert view[target[0]][target[1]] == CELL_SHOT
+    assert sum(cell != CELL_UNKNOWN for row in view for cell in row) == 1
+
+#Случайная игра: события shot не содержат клеток целых кораблей, лента зрителя совпадает с публичными досками
+def test_shot_events_reveal_only_sunk_ships():
+    async def scenario():
+        spectators = Spectators(ConnectionManager(), None)
+        state = make_state(seed=3)
+        feed = Feed(1, 0)
+        feed.apply({"type": "spectate_info", "seq": 0, "turn": state.current_turn,
+                    "boards": {key: public_board(state, key) for key in ("player1", "player2")}})
+        rng = random.Random(5)
+        shots = {player: [(x, y) for x in range(10) for y in range(10)] for player in (1, 2)}
+        for targets in shots.values():
+            rng.shuffle(targets)
+        while state.winner is None:
+            player = state.current_turn
+            col, row = shots[player].pop()
+            result = state.move(player, col, row)
+            event = spectators.shot_event(state, player, col, row, result)
+            assert set(event) <= {"type", "seq", "player", "board", "col", "row", "hit", "kill", "turn", "game_over", "ship_cells"}
+            assert ("ship_cells" in event) == result["kill"]
+            board = state.desk[event["board"]]
+            for x, y in event.get("ship_cells", []):
+                assert board[x][y] == -1
+            feed.apply(event)
+            for key in ("player1", "player2"):
+                assert feed.boards[key] == public_board(state, key)
+                assert_no_hidden_ships(state, feed.boards[key], key)
+        assert event["game_over"] and feed.seq == state.seq
+        feed.stop()
+    asyncio.run(scenario())
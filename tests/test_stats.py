@@ -0,0 +1,54 @@
+import asyncio
+import datetime
+
+from models import PlayerStats
+from stats import record_game, record_result, stats_info
+
+DAY = datetime.datetime(2026, 3, 1, 12, 0)
+
+async def play(session_factory, results, player_id=1, opponent=2):
+    for days, won in results:
+        async with session_factory() as db:
+            winner = player_id if won else opponent
+            date_ended = DAY + datetime.timedelta(days=days)
+            await record_game(db, player_id, opponent, winner, 30, date_ended - datetime.timedelta(minutes=5), date_ended)
+            await db.commit()
+
+async def get_stats(session_factory, player_id):
+    async with session_factory() as db:
+        return await db.get(PlayerStats, player_id)
+
+#Серии считаются в SQL: победа после поражений начинает новую серию, самые длинные серии сохраняются
+def test_record_game_streaks(session_factory):
+    async def scenario():
+        await play(session_factory, [(0, True), (0, True), (1, False), (1, False), (1, False), (2, True)])
+        return await get_stats(session_factory, 1), await get_stats(session_factory, 2)
+    stats, opponent = asyncio.run(scenario())
+    assert (stats.games, stats.wins, stats.losses) == (6, 3, 3)
+    assert stats.current_streak == 1
+    assert (stats.longest_win_streak, stats.longest_loss_streak) == (2, 3)
+    assert (opponent.wins, opponent.losses, opponent.current_streak) == (3, 3, -1)
+    assert (stats.total_moves, stats.total_seconds) == (180, 1800)
+    assert stats.first_game == DAY and stats.last_game == DAY + datetime.timedelta(days=2)
+
+    info = stats_info(1, stats)
+    assert info["win_rate"] == 0.5 and info["avg_moves"] == 30.0 and info["avg_seconds"] == 300.0
+    assert info["games_per_day"] == 2.0
+
+#Одновременные игры игрока в разных транзакциях: обновления от значений строки, ни одна игра не теряется
+def test_record_result_concurrent_games(session_factory):
+    async def scenario():
+        await play(session_factory, [(0, True)])
+
+        async def finish(won):
+            async with session_factory() as db:
+                await record_result(db, 1, won, 10, 60, DAY)
+                await db.commit()
+        await asyncio.gather(*(finish(won) for won in (True, True, False)))
+        return await get_stats(session_factory, 1)
+    stats = asyncio.run(scenario())
+    assert (stats.games, stats.wins, stats.losses) == (4, 3, 1)
+    assert stats.total_moves == 60
+
+def test_stats_info_without_games():
+    assert stats_info(5)["games"] == 0 and stats_info(5)["win_rate"] == 0.0